@@ -31,6 +31,7 @@ module('fonts.py', base_path='src')
 module('glyphs.py', base_path='src')
 module('logging.py', base_path='src')
 module('main.py', base_path='src')
+module('scheduler.py', base_path='src')
 module('ssd1322.py', base_path='src')
 module('time_range.py', base_path='src')
 module('trains.py', base_path='src')
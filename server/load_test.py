@@ -0,0 +1,202 @@
+# Copyright (c) 2024 Tom Ward
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Load tests the proxy against a fake RTT server.
+
+Simulates devices polling the proxy's search endpoint, with RTT replaced by a
+local server answering searches from tests/fixtures and every service lookup
+with the same calling at stations. Reports request latency, and how many
+connections and requests the proxy made upstream.
+
+RTT is only reached over TLS, which is most of the cost of an upstream
+connection, so give the fake server a certificate to serve it over TLS too.
+The certificate needs to be for 127.0.0.1, e.g.:
+
+  openssl req -x509 -newkey rsa:2048 -nodes -days 1 -subj /CN=127.0.0.1 \\
+    -addext subjectAltName=IP:127.0.0.1 -keyout key.pem -out cert.pem
+  python load_test.py --cert cert.pem --key key.pem
+
+Use --server to load test another version of server.py, e.g. to compare
+against an earlier commit:
+
+  git show <commit>:server/server.py > /tmp/server_before.py
+  python load_test.py --cert cert.pem --key key.pem --server /tmp/server_before.py
+"""
+
+import argparse
+import asyncio
+import base64
+import datetime
+import importlib.util
+import json
+import logging
+import os
+import ssl
+import sys
+import tempfile
+import threading
+import time
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+_FIXTURE = os.path.join(_DIR, '..', 'tests', 'fixtures', 'search_btn_vic.json')
+_RTT_PORT = 18081
+_PROXY_PORT = 18082
+# How long the fake RTT server takes to answer each request.
+_SEARCH_LATENCY = 0.02
+_SERVICE_LATENCY = 0.01
+_AUTHORIZATION = 'Basic ' + base64.b64encode(b'username:password').decode()
+
+
+class _Upstream:
+  """Counts what the proxy asks of the fake RTT server."""
+
+  def __init__(self):
+    self.peers = set()
+    self.searches = 0
+    self.services = 0
+
+
+def _search_result(num_services: int):
+  with open(_FIXTURE) as f:
+    result = json.load(f)
+  result['services'] = result['services'][:num_services]
+  # Run today, so that calling at stations are cached as they would be live.
+  today = datetime.date.today().isoformat()
+  for service in result['services']:
+    service['runDate'] = today
+  return result
+
+
+async def _serve_rtt(
+    upstream: _Upstream, search_result, ssl_context: ssl.SSLContext | None
+):
+  from aiohttp import web
+
+  async def search(request: web.Request):
+    upstream.peers.add(request.transport.get_extra_info('peername'))
+    upstream.searches += 1
+    await asyncio.sleep(_SEARCH_LATENCY)
+    return web.json_response(search_result)
+
+  async def service(request: web.Request):
+    upstream.peers.add(request.transport.get_extra_info('peername'))
+    upstream.services += 1
+    await asyncio.sleep(_SERVICE_LATENCY)
+    return web.json_response({'locations': [{'crs': 'HHE'}, {'crs': 'VIC'}]})
+
+  rtt = web.Application()
+  rtt.router.add_get('/api/v1/json/search/{station}/to/{destination}', search)
+  rtt.router.add_get('/api/v1/json/service/{uid}/{yyyy}/{mm}/{dd}', service)
+  runner = web.AppRunner(rtt)
+  await runner.setup()
+  await web.TCPSite(
+      runner, '127.0.0.1', _RTT_PORT, ssl_context=ssl_context
+  ).start()
+
+
+def _run_rtt(upstream: _Upstream, search_result, ssl_context):
+  loop = asyncio.new_event_loop()
+  loop.run_until_complete(_serve_rtt(upstream, search_result, ssl_context))
+  loop.run_forever()
+
+
+async def _poll(devices: int, polls: int) -> list[float]:
+  """Polls the proxy from each device, returning each request's latency."""
+  import aiohttp
+
+  latencies = []
+
+  async def device():
+    for _ in range(polls):
+      # Devices don't share connections to the proxy.
+      async with aiohttp.ClientSession() as session:
+        start = time.perf_counter()
+        async with session.get(
+            f'http://127.0.0.1:{_PROXY_PORT}'
+            '/api/v1/json/search/BTN/to/VIC?slow_stations=HHE',
+            headers={'Authorization': _AUTHORIZATION},
+        ) as response:
+          await response.read()
+          if response.status != 200:
+            raise ValueError(f'Proxy returned {response.status}')
+        latencies.append(time.perf_counter() - start)
+
+  await asyncio.gather(*(device() for _ in range(devices)))
+  return sorted(latencies)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--server', default=os.path.join(_DIR, 'server.py'))
+  parser.add_argument('--devices', type=int, default=8)
+  parser.add_argument('--polls', type=int, default=10)
+  parser.add_argument('--services', type=int, default=12)
+  parser.add_argument('--cert', help='Serve fake RTT over TLS with this cert')
+  parser.add_argument('--key')
+  args = parser.parse_args()
+
+  ssl_context = None
+  scheme = 'http'
+  if args.cert:
+    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ssl_context.load_cert_chain(args.cert, args.key)
+    scheme = 'https'
+    # Trust the fake server. Must be set before aiohttp creates its default
+    # SSL context on import.
+    os.environ['SSL_CERT_FILE'] = os.path.abspath(args.cert)
+
+  upstream = _Upstream()
+  threading.Thread(
+      target=_run_rtt,
+      args=(upstream, _search_result(args.services), ssl_context),
+      daemon=True,
+  ).start()
+
+  spec = importlib.util.spec_from_file_location('server', args.server)
+  server = importlib.util.module_from_spec(spec)
+  sys.modules['server'] = server
+  spec.loader.exec_module(server)
+  server._RTT_ENDPOINT = f'{scheme}://127.0.0.1:{_RTT_PORT}/api/v1/json'
+  # Start with an empty calling at cache, rather than the proxy's.
+  cache_dir = tempfile.TemporaryDirectory()
+  server.app.config['CALLING_AT_CACHE'] = os.path.join(
+      cache_dir.name, 'calling_at.sqlite'
+  )
+
+  from werkzeug.serving import make_server
+
+  logging.getLogger('werkzeug').setLevel(logging.ERROR)
+  proxy = make_server('127.0.0.1', _PROXY_PORT, server.app, threaded=True)
+  threading.Thread(target=proxy.serve_forever, daemon=True).start()
+
+  start = time.perf_counter()
+  latencies = asyncio.run(_poll(args.devices, args.polls))
+  elapsed = time.perf_counter() - start
+  print(
+      f'{len(latencies)} requests in {elapsed:.2f}s '
+      f'p50={latencies[len(latencies) // 2] * 1e3:.0f}ms '
+      f'p99={latencies[int(len(latencies) * 0.99)] * 1e3:.0f}ms'
+  )
+  print(
+      f'upstream: connections={len(upstream.peers)} '
+      f'searches={upstream.searches} services={upstream.services}'
+  )
+
+
+if __name__ == '__main__':
+  main()
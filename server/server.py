@@ -20,7 +20,18 @@
 
 import asyncio
 from collections import OrderedDict
-from typing import Any, Sequence
+import copy
+import datetime
+import heapq
+import itertools
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+import zoneinfo
+from typing import Any, Awaitable, Sequence
 
 import aiohttp
 import logging
@@ -29,54 +40,507 @@ from flask import Flask
 
 _MAX_ATTEMPTS = 3
 _RTT_ENDPOINT = 'https://api.rtt.io/api/v1/json'
-_MAX_CACHED_CALLING_AT_STATIONS = 256
+# Stations services call at are cached on disk, until the day after they
+# run, as services run for at most 24 hours.
+_CALLING_AT_CACHE_DAYS = 2
+_CALLING_AT_PURGE_INTERVAL = 60 * 60
+# Stations looked up are written to disk together, this many seconds after the
+# first of them, rather than committing each one.
+_CALLING_AT_WRITE_DELAY = 1
+# Search results are shared between devices watching the same route, for up
+# to this many seconds.
+_SEARCH_CACHE_TTL = 10
+_MAX_CACHED_SEARCHES = 256
+# Routes served from the cache since they were last fetched are refreshed this
+# many seconds before they expire, so devices don't wait for the upstream.
+_SEARCH_REFRESH_AHEAD = 2
+# If refreshing an expired result takes longer than this, or fails, the stale
+# result is served instead, for up to _SEARCH_MAX_STALE seconds.
+_SEARCH_STALE_WAIT = 2
+_SEARCH_MAX_STALE = 5 * 60
+# Upstream connections are pooled and kept alive, with a session for each
+# credential, as RTT authenticates with basic auth.
+_MAX_UPSTREAM_SESSIONS = 32
+_UPSTREAM_POOL_SIZE = 16
+_UPSTREAM_KEEPALIVE_TIMEOUT = 60
+# Priorities of upstream requests when rate limited, lowest first. Searches
+# are what devices are waiting for, calling at stations only add detail.
+_SEARCH_PRIORITY = 0
+_CALLING_AT_PRIORITY = 1
+_MAX_BATCH_ROUTES = 16
+# RTT times are all local UK times.
+_UK_TIMEZONE = zoneinfo.ZoneInfo('Europe/London')
+# Window size used when deflating responses. Zlib records this in its header,
+# so keeping it small means devices only need a small window to inflate.
+_DEFLATE_WBITS = 10
+
+# Binary board format, decoded on devices by trains._parse_board(). A header
+# of the number of services and the station name is followed by a record for
+# each service. Strings are length-prefixed UTF-8, and times are [h]h[m]m.
+_BOARD_MAGIC = b'PTB1'
+_BOARD_HEADER = struct.Struct('<4sBB')
+# Booked, realtime and origin times, run date (year, month, day), flags, then
+# lengths of the serviceUid and destination that follow the record.
+_BOARD_SERVICE = struct.Struct('<HHHHBBBBB')
+_BOARD_CANCELLED = 1
+_BOARD_FAST_TRAIN = 2
+_BOARD_NO_TIME = 0xFFFF
+_BOARD_MAX_LENGTH = 255
+
+
+class _TokenBucket:
+  """Rate limits upstream requests, serving the most important first.
+
+  Tokens refill at `rate` a second, up to `burst`. Requests waiting for a
+  token are served in priority order, then take turns between routes, so one
+  route's calling at lookups can't hold up other routes. Only use on the
+  upstream loop.
+  """
+
+  def __init__(self, rate: float, burst: int):
+    # Otherwise waiters would never get a token.
+    if rate <= 0 or burst < 1:
+      raise ValueError(f'Expected rate > 0 and burst >= 1! {rate=} {burst=}')
+    self._rate = rate
+    self._burst = burst
+    self._tokens = float(burst)
+    self._updated = time.monotonic()
+    self._waiters = []
+    self._order = itertools.count()
+    # Each route's last turn, and the turn last served.
+    self._route_turns = {}
+    self._turn = 0
+    self._timer = None
+
+  def _refill(self):
+    now = time.monotonic()
+    self._tokens = min(
+        self._burst, self._tokens + (now - self._updated) * self._rate
+    )
+    self._updated = now
+
+  async def acquire(self, priority: int, route):
+    """Waits for a token to make an upstream request for `route`."""
+    self._refill()
+    if not self._waiters and self._tokens >= 1:
+      self._tokens -= 1
+      return
+
+    turn = max(self._turn, self._route_turns.get(route, 0)) + 1
+    self._route_turns[route] = turn
+    waiter = asyncio.get_running_loop().create_future()
+    heapq.heappush(self._waiters, (priority, turn, next(self._order), waiter))
+    self._schedule()
+    try:
+      await waiter
+    except asyncio.CancelledError:
+      if not waiter.cancelled():
+        # Cancelled after being given a token, so give it back.
+        self._tokens += 1
+      raise
+
+  def throttle(self):
+    """Empties the bucket, e.g. when the upstream says it's rate limiting."""
+    self._refill()
+    self._tokens = min(self._tokens, 0)
+
+  def _schedule(self):
+    if self._timer is None and self._waiters:
+      delay = max(0, (1 - self._tokens) / self._rate)
+      self._timer = asyncio.get_running_loop().call_later(delay, self._release)
+
+  def _release(self):
+    self._timer = None
+    self._refill()
+    while self._waiters and self._tokens >= 1:
+      _, turn, _, waiter = heapq.heappop(self._waiters)
+      if waiter.cancelled():
+        continue
+      self._tokens -= 1
+      self._turn = turn
+      waiter.set_result(None)
+    if not self._waiters:
+      self._route_turns.clear()
+    self._schedule()
+
+
+class _CachedSearch:
+  """Cached search result, with how often it's been served from the cache."""
+
+  def __init__(self, result: tuple[Any, int, dict[str, Any]]):
+    self.result = result
+    self.fetched = time.monotonic()
+    self.requests = 0
+
+  def age(self) -> float:
+    return time.monotonic() - self.fetched
+
+  def copy(self) -> tuple[Any, int, dict[str, Any]]:
+    result, status_code, headers = self.result
+    headers = headers.copy()
+    headers['Age'] = str(int(self.age()))
+    # Callers add to results, so give each its own copy.
+    return copy.deepcopy(result), status_code, headers
 
 
 class TrainFlask(Flask):
 
   def __init__(self, name: str):
     super().__init__(name)
-    self._calling_at_cache = OrderedDict()
+    # Can be overridden with FLASK_ prefixed environment variables.
+    self.config.setdefault(
+        'CALLING_AT_CACHE',
+        os.path.join(os.path.dirname(__file__), 'calling_at.sqlite'),
+    )
+    self.config.setdefault('MAX_CALLING_AT_LOOKUPS', 8)
+    # Upstream requests a second, and burst of requests, for each credential.
+    self.config.setdefault('UPSTREAM_RATE', 5)
+    self.config.setdefault('UPSTREAM_BURST', 20)
+    self.config.from_prefixed_env()
 
-  def get_calling_at(self, uid: str, date: str):
-    key = f'{uid}_{date}'
-    value = self._calling_at_cache.get(key)
-    if value is not None:
-      self._calling_at_cache.move_to_end(key)
-    return value
+    # All only used on the upstream loop.
+    self._calling_at_cache = None
+    self._calling_at_purged = 0.0
+    self._calling_at_pending = {}
+    self._calling_at_lookups = {}
+    self._calling_at_semaphore = None
+    self._search_cache = OrderedDict()
+    self._searches = {}
+    self._upstream_loop = None
+    self._upstream_lock = threading.Lock()
+    self._sessions = OrderedDict()
+    self._rate_limiters = {}
 
-  def add_calling_at(self, uid, date, stations: Sequence[str]):
-    key = f'{uid}_{date}'
-    self._calling_at_cache[key] = stations
-    self._calling_at_cache.move_to_end(key)
-    if len(self._calling_at_cache) > _MAX_CACHED_CALLING_AT_STATIONS:
-      self._calling_at_cache.popitem(last=False)
+  async def search_trains(
+      self, auth, station: str, destination: str
+  ) -> tuple[Any, int, dict[str, Any]]:
+    """Cached _get_trains(). Only call on the upstream loop.
 
+    Concurrent searches for the same route share a single upstream request,
+    and successful results are reused for _SEARCH_CACHE_TTL seconds. Results
+    are scoped to the credential, so that they're only shared with devices
+    that RTT would give them to.
 
-app = TrainFlask(__name__)
+    Hot routes are refreshed in the background before they expire. If the
+    upstream is slow or failing, stale results are served with an Age header
+    rather than making devices wait.
+    """
+    key = (auth.username, auth.password, station, destination)
+    cached = self._search_cache.get(key)
+    if cached is not None and cached.age() < _SEARCH_CACHE_TTL:
+      cached.requests += 1
+      return cached.copy()
+    if cached is not None and cached.age() >= _SEARCH_MAX_STALE:
+      cached = None
+
+    search = self._start_search(auth, key, station, destination)
+    # Don't cancel the search for everyone else if this request is cancelled.
+    if cached is None:
+      result, status_code, headers = await asyncio.shield(search)
+    else:
+      try:
+        result, status_code, headers = await asyncio.wait_for(
+            asyncio.shield(search), _SEARCH_STALE_WAIT
+        )
+      except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.warning(f'Serving stale search, upstream error: {e!r}')
+        return cached.copy()
+      if status_code >= 500 or status_code == 429:
+        logging.warning(f'Serving stale search, upstream status {status_code}')
+        return cached.copy()
+    # Callers add to results, so give each its own copy.
+    return copy.deepcopy(result), status_code, headers
+
+  def _start_search(
+      self, auth, key, station: str, destination: str
+  ) -> asyncio.Future:
+    """Searches upstream, unless a search for `key` is already in flight."""
+    search = self._searches.get(key)
+    if search is None:
+      search = asyncio.ensure_future(
+          _get_trains(
+              self.session(auth), self.rate_limiter(auth), station, destination
+          )
+      )
+      self._searches[key] = search
+      search.add_done_callback(
+          lambda _: self._cache_search(auth, key, station, destination, search)
+      )
+    return search
 
+  def _cache_search(
+      self, auth, key, station: str, destination: str, search: asyncio.Future
+  ):
+    del self._searches[key]
+    if search.cancelled() or search.exception() is not None:
+      return
+    if search.result()[1] != 200:
+      return
 
-async def _get_calling_at(session: aiohttp.ClientSession, uid: str, date: str):
-  if cached_result := app.get_calling_at(uid, date):
-    return uid, cached_result
+    cached = _CachedSearch(search.result())
+    self._search_cache.pop(key, None)
+    self._search_cache[key] = cached
+    # Entries are in the order they were fetched, so the oldest go first.
+    while self._search_cache:
+      oldest = next(iter(self._search_cache.values()))
+      if (
+          oldest.age() < _SEARCH_MAX_STALE
+          and len(self._search_cache) <= _MAX_CACHED_SEARCHES
+      ):
+        break
+      self._search_cache.popitem(last=False)
+
+    asyncio.get_running_loop().call_later(
+        _SEARCH_CACHE_TTL - _SEARCH_REFRESH_AHEAD,
+        self._refresh_search,
+        auth,
+        key,
+        station,
+        destination,
+        cached,
+    )
+
+  def _refresh_search(
+      self, auth, key, station: str, destination: str, cached: _CachedSearch
+  ):
+    """Refreshes `cached` before it expires, if it's still being requested.
+
+    Routes only watched by a single device are left to expire, otherwise
+    they'd be refreshed more often than the device asks for them.
+    """
+    if self._search_cache.get(key) is cached and cached.requests:
+      self._start_search(auth, key, station, destination)
+
+  def upstream(self, coro: Awaitable) -> Awaitable:
+    """Runs `coro` on the upstream event loop, which owns pooled sessions.
+
+    Flask runs each async view in its own short-lived event loop, so sessions
+    can't be shared between requests there. Instead they live on a long-lived
+    loop in a background thread, where all upstream requests are made.
+    """
+    with self._upstream_lock:
+      if self._upstream_loop is None:
+        self._upstream_loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=self._upstream_loop.run_forever,
+            name='upstream',
+            daemon=True,
+        ).start()
+    return asyncio.wrap_future(
+        asyncio.run_coroutine_threadsafe(coro, self._upstream_loop)
+    )
 
+  def session(self, auth) -> aiohttp.ClientSession:
+    """Returns pooled session for `auth`. Only call on the upstream loop."""
+    key = (auth.username, auth.password)
+    session = self._sessions.get(key)
+    if session is None or session.closed:
+      session = aiohttp.ClientSession(
+          auth=aiohttp.BasicAuth(auth.username, auth.password),
+          connector=aiohttp.TCPConnector(
+              limit=_UPSTREAM_POOL_SIZE,
+              keepalive_timeout=_UPSTREAM_KEEPALIVE_TIMEOUT,
+          ),
+      )
+      self._sessions[key] = session
+    self._sessions.move_to_end(key)
+    if len(self._sessions) > _MAX_UPSTREAM_SESSIONS:
+      oldest_key, oldest = self._sessions.popitem(last=False)
+      self._rate_limiters.pop(oldest_key, None)
+      # Let requests already using it finish before closing.
+      asyncio.get_running_loop().call_later(
+          _UPSTREAM_KEEPALIVE_TIMEOUT,
+          lambda: asyncio.ensure_future(oldest.close()),
+      )
+    return session
+
+  def rate_limiter(self, auth) -> _TokenBucket:
+    """Returns rate limiter for `auth`. Only call on the upstream loop."""
+    key = (auth.username, auth.password)
+    rate_limiter = self._rate_limiters.get(key)
+    if rate_limiter is None:
+      rate_limiter = _TokenBucket(
+          self.config['UPSTREAM_RATE'], self.config['UPSTREAM_BURST']
+      )
+      self._rate_limiters[key] = rate_limiter
+    return rate_limiter
+
+  async def calling_at(
+      self,
+      session: aiohttp.ClientSession,
+      rate_limiter: _TokenBucket,
+      route,
+      uid: str,
+      date: str,
+  ) -> list[str] | None:
+    """Cached _fetch_calling_at(). Only call on the upstream loop.
+
+    Concurrent lookups of the same service share a single upstream request,
+    and at most MAX_CALLING_AT_LOOKUPS are made at once.
+    """
+    if stations := self.get_calling_at(uid, date):
+      return stations
+
+    key = (uid, date)
+    lookup = self._calling_at_lookups.get(key)
+    if lookup is None:
+      if self._calling_at_semaphore is None:
+        self._calling_at_semaphore = asyncio.Semaphore(
+            self.config['MAX_CALLING_AT_LOOKUPS']
+        )
+      lookup = asyncio.ensure_future(
+          self._lookup_calling_at(session, rate_limiter, route, uid, date)
+      )
+      self._calling_at_lookups[key] = lookup
+      lookup.add_done_callback(lambda _: self._calling_at_lookups.pop(key))
+    return await asyncio.shield(lookup)
+
+  async def _lookup_calling_at(
+      self,
+      session: aiohttp.ClientSession,
+      rate_limiter: _TokenBucket,
+      route,
+      uid: str,
+      date: str,
+  ) -> list[str] | None:
+    stations = await _fetch_calling_at(
+        session, rate_limiter, route, uid, date, self._calling_at_semaphore
+    )
+    if stations is not None:
+      self.add_calling_at(uid, date, stations)
+    return stations
+
+  def _calling_at_db(self) -> sqlite3.Connection | None:
+    """Returns the on disk cache, or None if it can't be used."""
+    if self._calling_at_cache is None:
+      try:
+        db = sqlite3.connect(self.config['CALLING_AT_CACHE'])
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS calling_at ('
+            'uid TEXT, run_date TEXT, stations TEXT, expires REAL, '
+            'PRIMARY KEY (uid, run_date))'
+        )
+      except sqlite3.Error as e:
+        # Carry on without it, rather than failing every search.
+        logging.error(f'Calling at cache disabled, sqlite error: {e!r}')
+        self._calling_at_cache = False
+        return None
+      self._calling_at_cache = db
+    if not self._calling_at_cache:
+      return None
+    now = time.time()
+    if now - self._calling_at_purged > _CALLING_AT_PURGE_INTERVAL:
+      self._calling_at_purged = now
+      try:
+        with self._calling_at_cache:
+          self._calling_at_cache.execute(
+              'DELETE FROM calling_at WHERE expires <= ?', (now,)
+          )
+      except sqlite3.Error as e:
+        logging.warning(f'Failed to purge calling at cache: {e!r}')
+    return self._calling_at_cache
+
+  def get_calling_at(self, uid: str, date: str) -> list[str] | None:
+    if (pending := self._calling_at_pending.get((uid, date))) is not None:
+      return pending[0].split(',')
+    if (db := self._calling_at_db()) is None:
+      return None
+    try:
+      row = db.execute(
+          'SELECT stations FROM calling_at '
+          'WHERE uid = ? AND run_date = ? AND expires > ?',
+          (uid, date, time.time()),
+      ).fetchone()
+    except sqlite3.Error as e:
+      logging.warning(f'Failed to read calling at cache: {e!r}')
+      return None
+    return row[0].split(',') if row else None
+
+  def add_calling_at(self, uid: str, date: str, stations: Sequence[str]):
+    """Caches `stations`, written to disk with others added soon after."""
+    expires = datetime.datetime.fromisoformat(date).replace(
+        tzinfo=_UK_TIMEZONE
+    ) + datetime.timedelta(days=_CALLING_AT_CACHE_DAYS)
+    if not self._calling_at_pending:
+      asyncio.get_running_loop().call_later(
+          _CALLING_AT_WRITE_DELAY, self._write_calling_at
+      )
+    self._calling_at_pending[(uid, date)] = (
+        ','.join(stations),
+        expires.timestamp(),
+    )
+
+  def _write_calling_at(self):
+    pending = self._calling_at_pending
+    self._calling_at_pending = {}
+    if (db := self._calling_at_db()) is None:
+      return
+    try:
+      with db:
+        db.executemany(
+            'INSERT OR REPLACE INTO calling_at VALUES (?, ?, ?, ?)',
+            (
+                (uid, date, stations, expires)
+                for (uid, date), (stations, expires) in pending.items()
+            ),
+        )
+    except sqlite3.Error as e:
+      logging.warning(f'Failed to write calling at cache: {e!r}')
+
+
+app = TrainFlask(__name__)
+
+
+async def _fetch_calling_at(
+    session: aiohttp.ClientSession,
+    rate_limiter: _TokenBucket,
+    route,
+    uid: str,
+    date: str,
+    semaphore: asyncio.Semaphore,
+) -> list[str] | None:
   yyyy, mm, dd = date.split('-')
-  async with session.get(
-      f'{_RTT_ENDPOINT}/service/{uid}/{yyyy}/{mm}/{dd}'
-  ) as response:
-    if response.status == 200:
-      stations = [
-          location['crs'] for location in (await response.json())['locations']
-      ]
-      app.add_calling_at(uid, date, stations)
-      return uid, stations
-  return uid, None
+  await rate_limiter.acquire(_CALLING_AT_PRIORITY, route)
+  async with semaphore:
+    async with session.get(
+        f'{_RTT_ENDPOINT}/service/{uid}/{yyyy}/{mm}/{dd}'
+    ) as response:
+      if response.status == 429:
+        rate_limiter.throttle()
+      if response.status == 200:
+        return [
+            location['crs']
+            for location in (await response.json())['locations']
+        ]
+  return None
+
+
+async def _get_calling_at(
+    session: aiohttp.ClientSession,
+    rate_limiter: _TokenBucket,
+    route,
+    uid: str,
+    date: str,
+):
+  return uid, await app.calling_at(session, rate_limiter, route, uid, date)
 
 
-async def _get_calling_stations(session: aiohttp.ClientSession, search_result):
-  services = search_result.get('services')
+async def _get_calling_stations(
+    session: aiohttp.ClientSession,
+    rate_limiter: _TokenBucket,
+    route,
+    search_result,
+):
+  # RTT returns null services when there aren't any.
+  services = search_result.get('services') or []
   tasks = {
-      _get_calling_at(session, service['serviceUid'], service['runDate'])
+      _get_calling_at(
+          session,
+          rate_limiter,
+          route,
+          service['serviceUid'],
+          service['runDate'],
+      )
       for service in services
   }
   calling_stations = {
@@ -90,17 +554,23 @@ async def _get_calling_stations(session: aiohttp.ClientSession, search_result):
 
 
 async def _get_trains(
-    session: aiohttp.ClientSession, station: str, destination: str
+    session: aiohttp.ClientSession,
+    rate_limiter: _TokenBucket,
+    station: str,
+    destination: str,
 ) -> tuple[Any, int, dict[str, Any]]:
+  await rate_limiter.acquire(_SEARCH_PRIORITY, (station, destination))
   async with await session.get(
       f'{_RTT_ENDPOINT}/search/{station}/to/{destination}'
   ) as response:
+    if response.status == 429:
+      rate_limiter.throttle()
     if response.status != 200:
       return await response.content.read(), response.status, response.headers
     input = await response.json()
 
     result = {'location': {'name': input['location']['name']}}
-    for service in input.get('services', []):
+    for service in input.get('services') or []:
       location = service['locationDetail']
 
       out_service = {
@@ -132,32 +602,382 @@ async def _get_trains(
     return result, response.status, response.headers
 
 
+def _set_fast_trains(result, slow_stations: set[str]):
+  """Replaces each service's callingAt with whether it's a fast train.
+
+  Services are fast if they call at none of `slow_stations`. Without any slow
+  stations, or calling at stations for the service, it's never fast.
+  """
+  for service in result.get('services') or []:
+    calling_at = service.pop('callingAt', None)
+    service['fast'] = bool(
+        slow_stations and calling_at and slow_stations.isdisjoint(calling_at)
+    )
+
+
+def _slow_stations() -> set[str] | None:
+  """Returns slow_stations query parameter, if provided."""
+  slow_stations = flask.request.args.get('slow_stations')
+  if slow_stations is None:
+    return None
+  return set(filter(None, slow_stations.split(',')))
+
+
+def _board_string(value: str) -> bytes:
+  data = value.encode()
+  if len(data) > _BOARD_MAX_LENGTH:
+    data = data[:_BOARD_MAX_LENGTH].decode(errors='ignore').encode()
+  return data
+
+
+def _encode_board(result) -> bytes:
+  """Encodes trimmed search result into the binary board format.
+
+  Services are flagged as fast if marked so by _set_fast_trains().
+  """
+  services = (result.get('services') or [])[:_BOARD_MAX_LENGTH]
+  name = _board_string(result['location']['name'])
+  data = [_BOARD_HEADER.pack(_BOARD_MAGIC, len(services), len(name)), name]
+  for service in services:
+    location = service['locationDetail']
+    booked_departure = int(location['gbttBookedDeparture'])
+    realtime_departure = location.get('realtimeDeparture')
+    origins = location['origin']
+    year = month = day = 0
+    if run_date := service.get('runDate'):
+      year, month, day = (int(part) for part in run_date.split('-'))
+
+    flags = 0
+    if location.get('cancelReasonCode'):
+      flags |= _BOARD_CANCELLED
+    if service.get('fast'):
+      flags |= _BOARD_FAST_TRAIN
+
+    # Iff the service is cancelled, service['destination'] is populated.
+    destinations = service.get('destination') or location['destination']
+    destination = _board_string(
+        ','.join(d['description'] for d in destinations)
+    )
+    uid = _board_string(service.get('serviceUid', ''))
+    data.append(
+        _BOARD_SERVICE.pack(
+            booked_departure,
+            int(realtime_departure)
+            if realtime_departure
+            else booked_departure,
+            int(origins[0]['publicTime']) if origins else _BOARD_NO_TIME,
+            year,
+            month,
+            day,
+            flags,
+            len(uid),
+            len(destination),
+        )
+    )
+    data.append(uid)
+    data.append(destination)
+  return b''.join(data)
+
+
+def _minutes_until(hh_mm: str, now: datetime.datetime) -> int:
+  """Returns minutes from `now` until HHMM time, negative if it's passed.
+
+  Times more than 12 hours ahead are assumed to have already passed.
+  """
+  minutes = (
+      int(hh_mm[:2]) * 60 + int(hh_mm[2:4]) - now.hour * 60 - now.minute
+  ) % (24 * 60)
+  return minutes - 24 * 60 if minutes >= 12 * 60 else minutes
+
+
+def _truncate_services(
+    result,
+    limit: int | None,
+    horizon_minutes: int | None,
+    min_departure_time: int | None = None,
+):
+  """Drops services beyond the first `limit`, or `horizon_minutes` away.
+
+  Services leaving within `min_departure_time` minutes are dropped first, the
+  same as devices would, so that they don't take up any of `limit`. Done
+  before looking up calling at stations, so that services devices won't show
+  don't cost any upstream requests.
+  """
+  services = result.get('services')
+  if not services:
+    return
+  now = datetime.datetime.now(_UK_TIMEZONE)
+  if min_departure_time:
+    services = [
+        service
+        for service in services
+        if _minutes_until(_device_departure_time(service), now)
+        >= min_departure_time
+    ]
+  if horizon_minutes is not None:
+    services = [
+        service
+        for service in services
+        if _minutes_until(
+            service['locationDetail'].get('realtimeDeparture')
+            or service['locationDetail']['gbttBookedDeparture'],
+            now,
+        )
+        <= horizon_minutes
+    ]
+  if limit is not None:
+    services = services[:limit]
+  result['services'] = services
+
+
+def _device_departure_time(service) -> str:
+  """Returns HHMM time devices compare against their min_departure_time."""
+  location = service['locationDetail']
+  if location.get('cancelReasonCode') is not None:
+    return location.get('realtimeDeparture') or location['gbttBookedDeparture']
+  return location['gbttBookedDeparture']
+
+
+def _deflate(response: flask.Response):
+  compressor = zlib.compressobj(9, zlib.DEFLATED, _DEFLATE_WBITS)
+  data = compressor.compress(response.get_data()) + compressor.flush()
+  response.set_data(data)
+  response.headers['Content-Encoding'] = 'deflate'
+  response.vary.add('Accept-Encoding')
+
+
+async def _search(
+    auth,
+    station: str,
+    destination: str,
+    limit: int | None = None,
+    horizon_minutes: int | None = None,
+    min_departure_time: int | None = None,
+):
+  """Searches RTT for trains. Must run on the upstream loop, see upstream()."""
+  session = app.session(auth)
+  for i in range(1, _MAX_ATTEMPTS + 1):
+    try:
+      result, status_code, headers = await app.search_trains(
+          auth, station, destination
+      )
+      if status_code == 200:
+        _truncate_services(
+            result, limit, horizon_minutes, min_departure_time
+        )
+        result = await _get_calling_stations(
+            session, app.rate_limiter(auth), (station, destination), result
+        )
+      break
+    except aiohttp.ClientConnectionError as e:
+      logging.warning(f'Connection error {i} of 3! error: {e}')
+      await asyncio.sleep(1)
+
+  headers = headers.copy()
+  # Chunked responses don't have one.
+  headers.pop('content-length', None)
+  return result, status_code, headers
+
+
+async def _search_all(
+    auth,
+    routes: Sequence[tuple[str, str]],
+    limit: int | None = None,
+    horizon_minutes: int | None = None,
+    min_departure_time: int | None = None,
+):
+  """Searches each of `routes` concurrently. Must run on the upstream loop."""
+  return await asyncio.gather(
+      *(
+          _search(
+              auth,
+              station,
+              destination,
+              limit,
+              horizon_minutes,
+              min_departure_time,
+          )
+          for station, destination in routes
+      )
+  )
+
+
+def _batch_routes() -> list[tuple[str, str]]:
+  """Returns routes to batch, from a JSON body or routes query parameter.
+
+  The body is {"routes": [{"station": ..., "destination": ...}, ...]}, and
+  the query parameter a comma separated list of station-destination pairs.
+  """
+  if flask.request.method == 'POST':
+    body = flask.request.get_json(silent=True)
+    try:
+      routes = [(r['station'], r['destination']) for r in body['routes']]
+    except (KeyError, TypeError):
+      flask.abort(400, 'Expected {"routes": [{"station", "destination"}]}')
+  else:
+    routes = [
+        tuple(route.split('-', 1))
+        for route in flask.request.args.get('routes', '').split(',')
+        if route
+    ]
+  if not 0 < len(routes) <= _MAX_BATCH_ROUTES:
+    flask.abort(400, f'Expected 1-{_MAX_BATCH_ROUTES} routes! {routes=}')
+  for route in routes:
+    if len(route) != 2 or not all(isinstance(crs, str) for crs in route):
+      flask.abort(400, f'Invalid route! {route=}')
+  return routes
+
+
+async def _batch(auth, binary: bool):
+  """Searches for each batched route, returning boards in the same order.
+
+  Routes are only searched once, however many times they're included. If any
+  search fails, so does the whole batch.
+  """
+  routes = _batch_routes()
+  unique_routes = list(dict.fromkeys(routes))
+  searches = await app.upstream(
+      _search_all(auth, unique_routes, *_search_args())
+  )
+  slow_stations = _slow_stations()
+  boards = {}
+  age = None
+  for route, (result, status_code, headers) in zip(unique_routes, searches):
+    if status_code != 200:
+      return result, status_code, headers
+    if binary:
+      _set_fast_trains(result, slow_stations or set())
+    elif slow_stations is not None:
+      _set_fast_trains(result, slow_stations)
+    boards[route] = result
+    if 'age' in headers:
+      age = max(age or 0, int(headers['age']))
+
+  headers = searches[0][2]
+  headers.popall('age', None)
+  if age is not None:
+    headers['Age'] = str(age)
+  return [boards[route] for route in routes], 200, headers
+
+
+def _make_response(result, status_code: int, headers, mimetype=None):
+  if status_code != 200:
+    return result, status_code, headers.items()
+
+  # Upstream validators and encoding don't describe our trimmed response,
+  # so replace them with our own ETag to let devices make conditional
+  # requests.
+  for name in ('etag', 'last-modified', 'content-encoding'):
+    headers.popall(name, None)
+  if mimetype is not None:
+    headers.popall('content-type', None)
+  response = flask.make_response((result, status_code, headers.items()))
+  if mimetype is not None:
+    response.mimetype = mimetype
+  if 'deflate' in flask.request.accept_encodings:
+    _deflate(response)
+  response.add_etag()
+  return response.make_conditional(flask.request)
+
+
+def _int_arg(name: str, minimum: int) -> int | None:
+  """Returns integer query parameter `name`, or None if it isn't provided."""
+  value = flask.request.args.get(name)
+  if value is None:
+    return None
+  try:
+    value = int(value)
+  except ValueError:
+    flask.abort(400, f'{name} must be an integer! {value=}')
+  if value < minimum:
+    flask.abort(400, f'{name} must be >= {minimum}! {value=}')
+  return value
+
+
+def _search_args() -> tuple[int | None, int | None, int | None]:
+  """Returns limit, horizon_minutes and min_departure_time query parameters."""
+  return (
+      _int_arg('limit', 1),
+      _int_arg('horizon_minutes', 0),
+      _int_arg('min_departure_time', 0),
+  )
+
+
+def _unauthorized():
+  return flask.Response(
+      status=401, headers={'WWW-Authenticate': 'Basic realm="RTT API"'}
+  )
+
+
 @app.route('/api/v1/json/search/<station>/to/<destination>')
 async def search(station: str, destination: str):
+  """Trimmed search results, with the stations each service calls at.
+
+  If slow_stations is provided, each service instead has a boolean "fast",
+  whether it calls at none of them, which is much smaller than callingAt.
+  Only the first `limit` services, departing within `horizon_minutes`, are
+  included if provided. Services leaving within `min_departure_time` minutes
+  don't count towards `limit`.
+  """
   auth = flask.request.authorization
-  if auth and auth.type == 'basic':
-    async with aiohttp.ClientSession(
-        auth=aiohttp.BasicAuth(auth.username, auth.password)
-    ) as session:
-      for i in range(1, _MAX_ATTEMPTS + 1):
-        try:
-          result, status_code, headers = await _get_trains(
-              session, station, destination
-          )
-          if status_code == 200:
-            result = await _get_calling_stations(session, result)
-          break
-        except aiohttp.ClientConnectionError as e:
-          logging.warning(f'Connection error {i} of 3! error: {e}')
-          await asyncio.sleep(1)
-
-      headers = headers.copy()
-      del headers['content-length']
-      return result, status_code, headers.items()
-  else:
-    return flask.Response(
-        status=401, headers={'WWW-Authenticate': 'Basic realm="RTT API"'}
-    )
+  if not auth or auth.type != 'basic':
+    return _unauthorized()
+  result, status_code, headers = await app.upstream(
+      _search(auth, station, destination, *_search_args())
+  )
+  slow_stations = _slow_stations()
+  if status_code == 200 and slow_stations is not None:
+    _set_fast_trains(result, slow_stations)
+  return _make_response(result, status_code, headers)
+
+
+# Served alongside search, so devices only need to change format to use it.
+@app.route('/api/v1/json/board/<station>/to/<destination>')
+async def board(station: str, destination: str):
+  """Same as search, but as a compact binary board, see _encode_board()."""
+  auth = flask.request.authorization
+  if not auth or auth.type != 'basic':
+    return _unauthorized()
+  result, status_code, headers = await app.upstream(
+      _search(auth, station, destination, *_search_args())
+  )
+  if status_code == 200:
+    _set_fast_trains(result, _slow_stations() or set())
+    result = _encode_board(result)
+  return _make_response(
+      result, status_code, headers, mimetype='application/octet-stream'
+  )
+
+
+@app.route('/api/v1/json/batch', methods=['GET', 'POST'])
+async def batch():
+  """Boards for several routes in one request, as {"boards": [...]}.
+
+  Each board is the same as from search. Takes the same query parameters,
+  which apply to every route, see _batch_routes() for how to give routes.
+  Devices should use GET, so that they can make conditional requests.
+  """
+  auth = flask.request.authorization
+  if not auth or auth.type != 'basic':
+    return _unauthorized()
+  boards, status_code, headers = await _batch(auth, binary=False)
+  if status_code == 200:
+    boards = {'boards': boards}
+  return _make_response(boards, status_code, headers)
+
+
+@app.route('/api/v1/json/batch/board', methods=['GET', 'POST'])
+async def batch_board():
+  """Same as batch, but as binary boards one after another, see board."""
+  auth = flask.request.authorization
+  if not auth or auth.type != 'basic':
+    return _unauthorized()
+  boards, status_code, headers = await _batch(auth, binary=True)
+  if status_code == 200:
+    boards = b''.join(_encode_board(board) for board in boards)
+  return _make_response(
+      boards, status_code, headers, mimetype='application/octet-stream'
+  )
 
 
 if __name__ == '__main__':
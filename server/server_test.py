@@ -0,0 +1,565 @@
+# Copyright (c) 2024 Tom Ward
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Tests for the proxy, with RTT stubbed out.
+
+Run from the repo root with:
+
+  pytest server
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+import time
+
+import multidict
+import pytest
+
+import server
+
+_FIXTURES = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures')
+_AUTH = ('username', 'password')
+_SEARCH = '/api/v1/json/search/BTN/to/VIC'
+
+
+def _search_result(services: int = 4):
+  """Returns RTT search response with `services` services running today."""
+  with open(os.path.join(_FIXTURES, 'search_btn_vic.json')) as f:
+    result = json.load(f)
+  result['services'] = result['services'][:services]
+  today = datetime.date.today().isoformat()
+  for service in result['services']:
+    service['runDate'] = today
+  return result
+
+
+class _Response:
+  """Upstream response, used like aiohttp's request context manager."""
+
+  def __init__(self, upstream: '_Upstream', path: str):
+    self._upstream = upstream
+    self._path = path
+    self._fetched = False
+    self.status = 0
+    self.headers = None
+    self._body = None
+
+  async def _fetch(self) -> '_Response':
+    if not self._fetched:
+      self._fetched = True
+      self.status, self._body, self.headers = await self._upstream.respond(
+          self._path
+      )
+    return self
+
+  def __await__(self):
+    return self._fetch().__await__()
+
+  async def __aenter__(self) -> '_Response':
+    return await self._fetch()
+
+  async def __aexit__(self, *exc_info):
+    pass
+
+  async def json(self):
+    return self._body
+
+  @property
+  def content(self):
+    return self
+
+  async def read(self) -> bytes:
+    return json.dumps(self._body).encode()
+
+
+class _Upstream:
+  """Stands in for RTT's session, counting the requests made of it."""
+
+  def __init__(self):
+    self.searches = collections.Counter()
+    self.services = collections.Counter()
+    self.results = collections.defaultdict(_search_result)
+    self.status = 200
+    self.delay = 0
+    self.chunked = False
+
+  def get(self, url: str) -> _Response:
+    assert url.startswith(server._RTT_ENDPOINT)
+    return _Response(self, url[len(server._RTT_ENDPOINT) :])
+
+  async def respond(self, path: str):
+    await asyncio.sleep(self.delay)
+    parts = path.split('/')
+    if parts[1] == 'search':
+      route = (parts[2], parts[4])
+      self.searches[route] += 1
+      body = self.results[route]
+    else:
+      self.services[parts[2]] += 1
+      body = {'locations': [{'crs': 'BTN'}, {'crs': 'HHE'}, {'crs': 'VIC'}]}
+    if self.status != 200:
+      body = {'error': 'Upstream error'}
+    headers = {'Content-Type': 'application/json'}
+    if not self.chunked:
+      headers['Content-Length'] = str(len(json.dumps(body)))
+    return (
+        self.status,
+        body,
+        multidict.CIMultiDictProxy(multidict.CIMultiDict(headers)),
+    )
+
+
+def _wait_for(condition, timeout: float = 2):
+  """Waits for `condition()` to be true, e.g. for work on the upstream loop."""
+  deadline = time.monotonic() + timeout
+  while not condition():
+    assert time.monotonic() < deadline, 'Timed out'
+    time.sleep(0.01)
+
+
+@pytest.fixture
+def upstream(monkeypatch, tmp_path):
+  """Stubs out RTT, with the proxy's caches emptied."""
+  upstream = _Upstream()
+  monkeypatch.setattr(server.app, 'session', lambda auth: upstream)
+  monkeypatch.setitem(
+      server.app.config,
+      'CALLING_AT_CACHE',
+      str(tmp_path / 'calling_at.sqlite'),
+  )
+  for name, value in (
+      ('_search_cache', collections.OrderedDict()),
+      ('_searches', {}),
+      ('_calling_at_cache', None),
+      ('_calling_at_purged', 0.0),
+      ('_calling_at_pending', {}),
+      ('_calling_at_lookups', {}),
+      ('_rate_limiters', {}),
+  ):
+    monkeypatch.setattr(server.app, name, value)
+  monkeypatch.setattr(server, '_CALLING_AT_WRITE_DELAY', 0.01)
+  yield upstream
+  # Finish writing to this test's calling at cache before it's put back.
+  _wait_for(lambda: not server.app._calling_at_pending)
+
+
+@pytest.fixture
+def client():
+  return server.app.test_client()
+
+
+def _get_all(paths):
+  """Requests each of `paths` at once, each with its own client."""
+
+  def get(path):
+    return server.app.test_client().get(path, auth=_AUTH)
+
+  with concurrent.futures.ThreadPoolExecutor(len(paths)) as executor:
+    return list(executor.map(get, paths))
+
+
+def _expire(route=('BTN', 'VIC'), age: float = server._SEARCH_CACHE_TTL):
+  """Makes cached search for `route` `age` seconds older."""
+  (cached,) = [
+      cached
+      for key, cached in server.app._search_cache.items()
+      if key[2:] == route
+  ]
+  cached.fetched -= age
+
+
+def test_search(upstream, client):
+  response = client.get(_SEARCH, auth=_AUTH)
+  assert response.status_code == 200
+  services = response.json['services']
+  assert len(services) == 4
+  assert services[0]['callingAt'] == ['BTN', 'HHE', 'VIC']
+  assert upstream.searches == {('BTN', 'VIC'): 1}
+  assert len(upstream.services) == 4
+
+
+def test_search_unauthorized(upstream, client):
+  assert client.get(_SEARCH).status_code == 401
+  assert not upstream.searches
+
+
+def test_search_cached(upstream, client):
+  client.get(_SEARCH, auth=_AUTH)
+  response = client.get(_SEARCH, auth=_AUTH)
+  assert response.status_code == 200
+  assert len(response.json['services']) == 4
+  assert 'Age' in response.headers
+  assert upstream.searches == {('BTN', 'VIC'): 1}
+
+
+def test_search_cached_per_credential(upstream, client):
+  client.get(_SEARCH, auth=_AUTH)
+  client.get(_SEARCH, auth=('other', 'password'))
+  assert upstream.searches == {('BTN', 'VIC'): 2}
+
+
+def test_search_cache_expires(upstream, client):
+  client.get(_SEARCH, auth=_AUTH)
+  _expire()
+  response = client.get(_SEARCH, auth=_AUTH)
+  assert response.status_code == 200
+  assert 'Age' not in response.headers
+  assert upstream.searches == {('BTN', 'VIC'): 2}
+
+
+def test_search_errors_not_cached(upstream, client):
+  upstream.status = 500
+  assert client.get(_SEARCH, auth=_AUTH).status_code == 500
+  upstream.status = 200
+  assert client.get(_SEARCH, auth=_AUTH).status_code == 200
+  assert upstream.searches == {('BTN', 'VIC'): 2}
+
+
+def test_concurrent_searches_coalesced(upstream):
+  upstream.delay = 0.2
+  responses = _get_all([_SEARCH] * 8)
+  assert [r.status_code for r in responses] == [200] * 8
+  assert upstream.searches == {('BTN', 'VIC'): 1}
+  # Calling at stations are only looked up once for each service too.
+  assert list(upstream.services.values()) == [1] * 4
+
+
+def test_search_results_not_shared(upstream, client):
+  client.get(_SEARCH + '?slow_stations=HHE', auth=_AUTH)
+  response = client.get(_SEARCH, auth=_AUTH)
+  # Unaffected by the first request replacing callingAt with fast.
+  assert 'fast' not in response.json['services'][0]
+  assert 'callingAt' in response.json['services'][0]
+
+
+def test_search_without_services(upstream, client):
+  upstream.results[('BTN', 'VIC')]['services'] = None
+  response = client.get(_SEARCH, auth=_AUTH)
+  assert response.status_code == 200
+  assert response.json == {'location': {'name': 'Brighton'}}
+
+
+def test_search_chunked(upstream, client):
+  upstream.chunked = True
+  assert client.get(_SEARCH, auth=_AUTH).status_code == 200
+
+
+def _cached_calling_at(path: str) -> list[tuple[str, str]]:
+  with contextlib.closing(sqlite3.connect(path)) as db:
+    return db.execute('SELECT uid, stations FROM calling_at').fetchall()
+
+
+def test_calling_at_cached_on_disk(upstream, client, monkeypatch):
+  client.get(_SEARCH, auth=_AUTH)
+  _wait_for(lambda: not server.app._calling_at_pending)
+  rows = _cached_calling_at(server.app.config['CALLING_AT_CACHE'])
+  assert sorted(uid for uid, _ in rows) == sorted(upstream.services)
+  assert {stations for _, stations in rows} == {'BTN,HHE,VIC'}
+
+  # Lookups are served from disk for other searches.
+  _expire()
+  client.get(_SEARCH, auth=_AUTH)
+  assert upstream.searches == {('BTN', 'VIC'): 2}
+  assert list(upstream.services.values()) == [1] * 4
+
+
+def test_calling_at_written_once(upstream, monkeypatch):
+  writes = []
+  add_calling_at = server.app.add_calling_at
+  monkeypatch.setattr(
+      server.app,
+      'add_calling_at',
+      lambda *args: writes.append(args) or add_calling_at(*args),
+  )
+  upstream.delay = 0.1
+  # Both routes have the same services, so share lookups.
+  _get_all([_SEARCH, '/api/v1/json/search/HOV/to/VIC'])
+  assert len(upstream.searches) == 2
+  assert list(upstream.services.values()) == [1] * 4
+  assert len(writes) == 4
+  assert len({uid for uid, _, _ in writes}) == 4
+
+
+@pytest.mark.parametrize('corrupt', (False, True))
+def test_calling_at_cache_unusable(
+    upstream, client, monkeypatch, tmp_path, corrupt
+):
+  path = tmp_path / 'calling_at.sqlite'
+  if corrupt:
+    path.write_bytes(b'Not a database')
+  else:
+    path = tmp_path / 'missing' / 'calling_at.sqlite'
+  monkeypatch.setitem(server.app.config, 'CALLING_AT_CACHE', str(path))
+  response = client.get(_SEARCH, auth=_AUTH)
+  assert response.status_code == 200
+  assert response.json['services'][0]['callingAt'] == ['BTN', 'HHE', 'VIC']
+  _wait_for(lambda: not server.app._calling_at_pending)
+  assert client.get(_SEARCH, auth=_AUTH).status_code == 200
+
+
+def test_stale_search_served_on_upstream_error(upstream, client):
+  client.get(_SEARCH, auth=_AUTH)
+  _expire(age=60)
+  upstream.status = 500
+  response = client.get(_SEARCH, auth=_AUTH)
+  assert response.status_code == 200
+  assert len(response.json['services']) == 4
+  assert int(response.headers['Age']) >= 60
+
+
+def test_stale_search_served_on_slow_upstream(upstream, client, monkeypatch):
+  monkeypatch.setattr(server, '_SEARCH_STALE_WAIT', 0.05)
+  client.get(_SEARCH, auth=_AUTH)
+  _expire(age=60)
+  upstream.delay = 0.3
+  response = client.get(_SEARCH, auth=_AUTH)
+  assert response.status_code == 200
+  assert int(response.headers['Age']) >= 60
+  # The search carries on, and refreshes the cache once it's done.
+  _wait_for(
+      lambda: int(client.get(_SEARCH, auth=_AUTH).headers.get('Age', 0)) < 60
+  )
+  assert upstream.searches == {('BTN', 'VIC'): 2}
+
+
+def test_stale_search_expires(upstream, client):
+  client.get(_SEARCH, auth=_AUTH)
+  _expire(age=server._SEARCH_MAX_STALE)
+  upstream.status = 500
+  assert client.get(_SEARCH, auth=_AUTH).status_code == 500
+
+
+def test_hot_search_refreshed_ahead(upstream, client, monkeypatch):
+  monkeypatch.setattr(server, '_SEARCH_CACHE_TTL', 0.3)
+  monkeypatch.setattr(server, '_SEARCH_REFRESH_AHEAD', 0.2)
+  client.get(_SEARCH, auth=_AUTH)
+  client.get(_SEARCH, auth=_AUTH)
+  _wait_for(lambda: upstream.searches[('BTN', 'VIC')] == 2)
+  # Served from the refreshed result.
+  response = client.get(_SEARCH, auth=_AUTH)
+  assert response.status_code == 200
+  assert upstream.searches == {('BTN', 'VIC'): 2}
+
+
+def test_cold_search_not_refreshed(upstream, client, monkeypatch):
+  monkeypatch.setattr(server, '_SEARCH_CACHE_TTL', 0.3)
+  monkeypatch.setattr(server, '_SEARCH_REFRESH_AHEAD', 0.2)
+  client.get(_SEARCH, auth=_AUTH)
+  time.sleep(0.3)
+  assert upstream.searches == {('BTN', 'VIC'): 1}
+
+
+async def _acquire_all(bucket: server._TokenBucket, requests):
+  """Acquires tokens for each (priority, route), returning the order given."""
+  order = []
+
+  async def acquire(request):
+    await bucket.acquire(*request)
+    order.append(request)
+
+  tasks = []
+  for request in requests:
+    tasks.append(asyncio.ensure_future(acquire(request)))
+    # Queue in order.
+    await asyncio.sleep(0)
+  await asyncio.gather(*tasks)
+  return order
+
+
+def test_token_bucket_burst():
+  bucket = server._TokenBucket(1, 3)
+  start = time.monotonic()
+  asyncio.run(_acquire_all(bucket, [(0, 'a')] * 3))
+  assert time.monotonic() - start < 0.1
+
+
+def test_token_bucket_priority_and_turns():
+  bucket = server._TokenBucket(200, 1)
+  requests = [
+      (server._CALLING_AT_PRIORITY, 'a'),
+      (server._CALLING_AT_PRIORITY, 'a'),
+      (server._CALLING_AT_PRIORITY, 'a'),
+      (server._CALLING_AT_PRIORITY, 'b'),
+      (server._SEARCH_PRIORITY, 'c'),
+  ]
+  order = asyncio.run(_acquire_all(bucket, requests))
+  # The first takes the only token, then searches go first, and routes take
+  # turns.
+  assert order == [
+      (server._CALLING_AT_PRIORITY, 'a'),
+      (server._SEARCH_PRIORITY, 'c'),
+      (server._CALLING_AT_PRIORITY, 'a'),
+      (server._CALLING_AT_PRIORITY, 'b'),
+      (server._CALLING_AT_PRIORITY, 'a'),
+  ]
+
+
+def test_token_bucket_rate():
+  bucket = server._TokenBucket(50, 1)
+  start = time.monotonic()
+  asyncio.run(_acquire_all(bucket, [(0, 'a')] * 6))
+  # The first is immediate, then each waits for a token.
+  assert time.monotonic() - start >= 5 / 50 * 0.9
+
+
+def test_token_bucket_throttle():
+  async def throttled():
+    bucket = server._TokenBucket(50, 10)
+    bucket.throttle()
+    start = time.monotonic()
+    await bucket.acquire(0, 'a')
+    return time.monotonic() - start
+
+  assert asyncio.run(throttled()) >= 1 / 50 * 0.9
+
+
+def test_token_bucket_cancelled_waiter():
+  async def cancelled():
+    bucket = server._TokenBucket(50, 1)
+    await bucket.acquire(0, 'a')
+    waiter = asyncio.ensure_future(bucket.acquire(0, 'a'))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    # The next waiter gets the token instead.
+    await asyncio.wait_for(bucket.acquire(0, 'b'), 1)
+
+  asyncio.run(cancelled())
+
+
+@pytest.mark.parametrize('rate, burst', ((0, 10), (-1, 10), (5, 0)))
+def test_token_bucket_invalid(rate, burst):
+  with pytest.raises(ValueError):
+    server._TokenBucket(rate, burst)
+
+
+_BATCH = '/api/v1/json/batch'
+
+
+def test_batch(upstream, client):
+  upstream.results[('HOV', 'VIC')]['location']['name'] = 'Hove'
+  response = client.get(
+      _BATCH + '?routes=BTN-VIC,HOV-VIC,BTN-VIC&limit=2', auth=_AUTH
+  )
+  assert response.status_code == 200
+  boards = response.json['boards']
+  assert [board['location']['name'] for board in boards] == [
+      'Brighton',
+      'Hove',
+      'Brighton',
+  ]
+  assert all(len(board['services']) == 2 for board in boards)
+  # Repeated routes are only searched once.
+  assert upstream.searches == {('BTN', 'VIC'): 1, ('HOV', 'VIC'): 1}
+
+
+def test_batch_post(upstream, client):
+  response = client.post(
+      _BATCH,
+      json={'routes': [{'station': 'BTN', 'destination': 'VIC'}]},
+      auth=_AUTH,
+  )
+  assert response.status_code == 200
+  assert len(response.json['boards']) == 1
+
+
+def test_batch_board(upstream, client):
+  upstream.results[('HOV', 'VIC')]['location']['name'] = 'Hove'
+  response = client.get(_BATCH + '/board?routes=BTN-VIC,HOV-VIC', auth=_AUTH)
+  assert response.status_code == 200
+  assert response.mimetype == 'application/octet-stream'
+  # The same as each route's board, one after another.
+  assert response.data == b''.join(
+      client.get(f'/api/v1/json/board/{station}/to/VIC', auth=_AUTH).data
+      for station in ('BTN', 'HOV')
+  )
+
+
+def test_batch_with_empty_board(upstream, client):
+  upstream.results[('HOV', 'VIC')]['services'] = None
+  response = client.get(_BATCH + '?routes=BTN-VIC,HOV-VIC', auth=_AUTH)
+  assert response.status_code == 200
+  assert 'services' not in response.json['boards'][1]
+
+
+def test_batch_fails_with_route(upstream, client):
+  client.get(_SEARCH, auth=_AUTH)
+  upstream.status = 500
+  response = client.get(_BATCH + '?routes=BTN-VIC,HOV-VIC', auth=_AUTH)
+  assert response.status_code == 500
+
+
+def test_batch_age(upstream, client):
+  client.get(_SEARCH, auth=_AUTH)
+  _expire(age=60)
+  upstream.status = 500
+  response = client.get(_BATCH + '?routes=BTN-VIC', auth=_AUTH)
+  assert response.status_code == 200
+  assert int(response.headers['Age']) >= 60
+
+
+@pytest.mark.parametrize(
+    'query',
+    (
+        '',
+        '?routes=',
+        '?routes=BTN',
+        '?routes=' + ','.join(['BTN-VIC'] * (server._MAX_BATCH_ROUTES + 1)),
+        '?routes=BTN-VIC&limit=0',
+    ),
+)
+def test_batch_invalid(upstream, client, query):
+  assert client.get(_BATCH + query, auth=_AUTH).status_code == 400
+  assert not upstream.searches
+
+
+@pytest.mark.parametrize(
+    'body',
+    (
+        None,
+        {},
+        {'routes': 'BTN-VIC'},
+        {'routes': [{'station': 'BTN'}]},
+        {'routes': [{'station': 'BTN', 'destination': 1}]},
+    ),
+)
+def test_batch_post_invalid(upstream, client, body):
+  response = client.post(_BATCH, json=body, auth=_AUTH)
+  assert response.status_code == 400
+  assert not upstream.searches
+
+
+@pytest.mark.parametrize(
+    'query',
+    (
+        'limit=abc',
+        'limit=0',
+        'horizon_minutes=x',
+        'horizon_minutes=-1',
+        'min_departure_time=1.5',
+        'min_departure_time=-1',
+    ),
+)
+def test_search_invalid(upstream, client, query):
+  assert client.get(f'{_SEARCH}?{query}', auth=_AUTH).status_code == 400
+  assert not upstream.searches
@@ -22,22 +22,94 @@ import display
 import time_range
 
 
+# Formats departures can be requested in. Binary needs the proxy in server/.
+_RTT_FORMATS = ('json', 'binary')
+# Any other endpoint is assumed to be the proxy in server/.
+_RTT_API = 'https://api.rtt.io/'
+# Each additional route is fetched on every update and has its own table of
+# departures, which the Pico only has so much memory for.
+_MAX_ADDITIONAL_ROUTES = 4
+
+
 class RttConfig:
   """Real-time trains configuration."""
 
   def __init__(
-      self, endpoint: str, username: str, password: str, update_interval: int
+      self,
+      endpoint: str,
+      username: str,
+      password: str,
+      update_interval: int,
+      min_update_interval: int | None = None,
+      max_update_interval: int | None = None,
+      format: str = 'json',
+      batch: bool = False,
   ):
     self.endpoint = endpoint
     self.username = username
     self.password = password
     self.update_interval = update_interval
+    # Only poll faster than update_interval if asked to.
+    self.min_update_interval = (
+        min_update_interval if min_update_interval else update_interval
+    )
+    self.max_update_interval = (
+        max_update_interval if max_update_interval else update_interval * 8
+    )
+    self.format = format
+    self.batch = batch
+
+  @property
+  def proxy(self) -> bool:
+    """Whether the endpoint is the proxy in server/, rather than RTT itself."""
+    return not self.endpoint.startswith(_RTT_API)
 
   def validate(self):
     if self.update_interval <= 0:
       raise ValueError(
           f'RTT update interval must be > 0! {self.update_interval=}'
       )
+    if not 0 < self.min_update_interval <= self.update_interval:
+      raise ValueError(
+          'RTT min update interval must be > 0 and <= update interval! '
+          f'{self.min_update_interval=}'
+      )
+    if self.max_update_interval < self.update_interval:
+      raise ValueError(
+          'RTT max update interval must be >= update interval! '
+          f'{self.max_update_interval=}'
+      )
+    if self.format not in _RTT_FORMATS:
+      raise ValueError(f'Unrecognized RTT format! format={self.format}')
+    if not isinstance(self.batch, bool):
+      raise ValueError(f'RTT batch must be a boolean! batch={self.batch}')
+    # Only the proxy serves these, RTT would return an error for every update.
+    if self.format != 'json' and not self.proxy:
+      raise ValueError(
+          f'RTT format {self.format} needs the proxy endpoint in server/! '
+          f'endpoint={self.endpoint}'
+      )
+    if self.batch and not self.proxy:
+      raise ValueError(
+          'RTT batch needs the proxy endpoint in server/! '
+          f'endpoint={self.endpoint}'
+      )
+
+
+class RouteConfig:
+  """Additional route to show departures for."""
+
+  def __init__(self, station: str, destination: str):
+    self.station = station
+    self.destination = destination
+
+  def validate(self):
+    if len(self.station) != 3:
+      raise ValueError(f'Invalid route station! station={self.station}')
+    if len(self.destination) != 3:
+      raise ValueError(
+          f'Invalid route destination! destination={self.destination}'
+      )
 
 
 class WifiConfig:
@@ -99,6 +171,7 @@ class Config:
       display: DisplayConfig,
       slow_station: str | None = None,
       min_departure_time: int = 0,
+      additional_routes: list[RouteConfig] | None = None,
       debug: DebugConfig = DebugConfig(),
   ):
     self.destination = destination
@@ -108,6 +181,7 @@ class Config:
     self.rtt = rtt
     self.display = display
     self.min_departure_time = min_departure_time
+    self.additional_routes = additional_routes if additional_routes else []
     self.debug = debug
     self.validate()
 
@@ -128,6 +202,13 @@ class Config:
           'Minimum departure time must be >= 0! '
           f'min_departure_time={self.min_departure_time}'
       )
+    if len(self.additional_routes) > _MAX_ADDITIONAL_ROUTES:
+      raise ValueError(
+          f'At most {_MAX_ADDITIONAL_ROUTES} additional routes are supported! '
+          f'{len(self.additional_routes)=}'
+      )
+    for route in self.additional_routes:
+      route.validate()
     self.debug.validate()
 
 
@@ -142,6 +223,8 @@ def load(config_json) -> Config:
       kwargs[k] = RttConfig(**v)
     elif k == 'debug':
       kwargs[k] = DebugConfig(**v)
+    elif k == 'additional_routes':
+      kwargs[k] = [RouteConfig(**r) for r in v]
     else:
       kwargs[k] = v
   return Config(**kwargs)
@@ -22,6 +22,7 @@ import asyncio
 import errno
 import gc
 import json
+import os
 import sys
 import time
 import _thread
@@ -36,6 +37,7 @@ import display
 import fonts
 import glyphs
 import logging
+import scheduler
 from setup import server
 import trains
 import utils
@@ -53,14 +55,37 @@ _SETUP_MESSAGE = (
     'Wifi: {}\nPassword: {}\nThen visit http://{}'
 )
 
-_MAX_ATTEMPTS = 3
 _CONNECT_TIMEOUT = 15
+# Consecutive failed updates before only probing the upstream occasionally.
+_FAILURE_THRESHOLD = 3
+_BACKOFF_BASE_DELAY = 2
+_BACKOFF_MAX_DELAY = 60
+_PROBE_INTERVAL = 5 * 60
+_WIFI_CHECK_INTERVAL = 5
+_EXPIRE_INTERVAL = 60
+_METRICS_INTERVAL = 60
+# Extra departures fetched beyond those that fit on the display, so that it
+# stays full as trains leave between updates, or are too soon to show.
+_SPARE_DEPARTURES = 4
+
+# Last board, saved to flash so it can be shown straight away on startup.
+_BOARD_CACHE = 'board.bin'
+_BOARD_CACHE_TMP = 'board.bin.tmp'
+# Limits wear on the flash by saving the board at most this often.
+_BOARD_CACHE_INTERVAL = 15 * 60
+# Saved boards older than this are dropped once the time is known.
+_BOARD_CACHE_MAX_AGE = 60 * 60
 
 gc.collect()
 
 
-def _connect(ssid: str, password: str, screen: display.Display) -> network.WLAN:
-  widget = widgets.MessageWidget(screen, _WIFI_CONNECT, fonts.DEFAULT_FONT)
+def _connect(
+    ssid: str, password: str, screen: display.Display | None
+) -> network.WLAN:
+  """Connects to wifi, showing progress on `screen` if given."""
+  widget = None
+  if screen is not None:
+    widget = widgets.MessageWidget(screen, _WIFI_CONNECT, fonts.DEFAULT_FONT)
   logging.log('Connecting to SSID: {} PASSWORD: {}', ssid, '*' * len(password))
 
   wlan = network.WLAN(network.STA_IF)
@@ -73,8 +98,9 @@ def _connect(ssid: str, password: str, screen: display.Display) -> network.WLAN:
       logging.log(wlan.ifconfig())
       return wlan
 
-    widget.render('{}{}'.format(_WIFI_CONNECT, '.' * (i % 4)))
-    screen.flush()
+    if widget is not None:
+      widget.render('{}{}'.format(_WIFI_CONNECT, '.' * (i % 4)))
+      screen.flush()
     time.sleep(1)
 
   raise OSError(
@@ -83,7 +109,7 @@ def _connect(ssid: str, password: str, screen: display.Display) -> network.WLAN:
   )
 
 
-def _reconnect(wlan: network.WLAN, ssid: str, password: str):
+async def _reconnect(wlan: network.WLAN, ssid: str, password: str):
   wlan.active(True)
   wlan.connect(ssid, password if password else None)
   for _ in range(_CONNECT_TIMEOUT):
@@ -91,9 +117,10 @@ def _reconnect(wlan: network.WLAN, ssid: str, password: str):
       logging.log('Reconnected to wifi!')
       return
 
-    time.sleep(1)
-  raise TimeoutError(
-      'Failed to reconnect to wifi in {} secs'.format(_CONNECT_TIMEOUT)
+    await asyncio.sleep(1)
+  raise OSError(
+      errno.ETIMEDOUT,
+      'Failed to reconnect to wifi in {} secs'.format(_CONNECT_TIMEOUT),
   )
 
 
@@ -109,6 +136,27 @@ def _configure_time():
   logging.log('Time set to UTC {}/{}/{} {}:{}', *t[:5])
 
 
+def _restore_departures(departure_updater: trains.DepartureUpdater) -> int:
+  """Restores the last saved board, returning when it was saved or -1."""
+  try:
+    with open(_BOARD_CACHE, 'rb') as f:
+      saved = departure_updater.restore(f.read())
+  except (OSError, ValueError, IndexError) as e:
+    logging.log('No saved departures restored: {}', e)
+    return -1
+  logging.log(
+      'Restored {} saved departures', len(departure_updater.departures())
+  )
+  return saved
+
+
+def _save_board(departures: trains.DepartureTable):
+  # Replace the saved board in one go, so a power cut can't leave it partial.
+  with open(_BOARD_CACHE_TMP, 'wb') as f:
+    f.write(departures.dump(time.time()))
+  os.rename(_BOARD_CACHE_TMP, _BOARD_CACHE)
+
+
 # TODO: Make this an enum when micropython supports such a thing
 class _ScreenState:
   ENTER_NON_ACTIVE = micropython.const(0)
@@ -149,7 +197,12 @@ def _render_thread(
 
       sleep_time_us = refresh_rate_us
       if state == _ScreenState.ACTIVE:
-        if active_time is not None and not active_time.in_range(now):
+        # Until the time is set, keep showing any restored departures.
+        if (
+            active_time is not None
+            and utils.is_time_set()
+            and not active_time.in_range(now)
+        ):
           state = _ScreenState.ENTER_NON_ACTIVE
         elif main_display.render(now):
           gc.collect()
@@ -185,6 +238,213 @@ def _render_thread(
     logging.log('Render thread closing...')
 
 
+async def _try_update(
+    departure_updater: trains.DepartureUpdater,
+    wlan: network.WLAN,
+    config: config_module.Config,
+    wifi_lock: asyncio.Lock,
+    breaker: scheduler.CircuitBreaker,
+) -> tuple[bool, int]:
+  """Updates departures, returning whether they changed and retry delay.
+
+  The retry delay is zero if the update succeeded. On failure, the last good
+  set of departures is kept so that the display carries on showing them.
+  """
+  try:
+    changed = await departure_updater.update()
+  except (OSError, ValueError, asyncio.TimeoutError) as e:
+    # Catch transient network or HTTP issues and back off before retrying.
+    sys.print_exception(e)
+    if isinstance(e, OSError) and e.errno == errno.ECONNABORTED:
+      logging.log('Received ECONNABORTED error, try reconnecting...')
+      departure_updater.close()
+      try:
+        async with wifi_lock:
+          await _reconnect(wlan, config.wifi.ssid, config.wifi.password)
+      except OSError as reconnect_error:
+        sys.print_exception(reconnect_error)
+    delay = breaker.failed()
+    logging.log(
+        'Train update failed, retrying in {} seconds{}',
+        delay,
+        ' (circuit open)' if breaker.is_open else '',
+    )
+    return False, delay
+
+  if breaker.succeeded():
+    logging.log('Train updates recovered, circuit closed')
+  return changed, 0
+
+
+async def _update_departures(
+    departure_updater: trains.DepartureUpdater,
+    wlan: network.WLAN,
+    config: config_module.Config,
+    wifi_lock: asyncio.Lock,
+    update_scheduler: scheduler.UpdateScheduler,
+    breaker: scheduler.CircuitBreaker,
+):
+  rtt = config.rtt
+  logging.log(
+      'Start updating departures every {}-{} seconds',
+      rtt.min_update_interval,
+      rtt.max_update_interval,
+  )
+  while True:
+    await asyncio.sleep_ms(update_scheduler.delay_ms())
+    changed, delay = await _try_update(
+        departure_updater, wlan, config, wifi_lock, breaker
+    )
+    gc.collect()
+    if delay:
+      update_scheduler.retry(delay)
+    else:
+      interval = update_scheduler.schedule(
+          departure_updater.departures(), changed
+      )
+      logging.log('Next departure update in {} seconds', interval)
+
+
+async def _supervise_wifi(
+    departure_updater: trains.DepartureUpdater,
+    wlan: network.WLAN,
+    config: config_module.Config,
+    wifi_lock: asyncio.Lock,
+):
+  """Reconnects to wifi as soon as the connection drops."""
+  while True:
+    await asyncio.sleep(_WIFI_CHECK_INTERVAL)
+    if not wlan.isconnected():
+      logging.log('Wifi disconnected, reconnecting...')
+      departure_updater.close()
+      try:
+        async with wifi_lock:
+          await _reconnect(wlan, config.wifi.ssid, config.wifi.password)
+      except OSError as e:
+        # Try again on the next check, rather than resetting the device.
+        sys.print_exception(e)
+
+
+async def _expire_departures(departure_updater: trains.DepartureUpdater):
+  """Drops departed trains from the board between updates.
+
+  Runs from startup, so trains restored from flash leave the board even if the
+  network is down, as long as the time has been set.
+  """
+  while True:
+    # Align with the start of each minute, when departures are due.
+    await asyncio.sleep(_EXPIRE_INTERVAL - utils.get_uk_time()[5])
+    if utils.is_time_set() and departure_updater.expire():
+      logging.log('Dropped departed trains from the board')
+
+
+async def _save_departures(
+    departure_updater: trains.DepartureUpdater, generation: int
+):
+  """Saves the board to flash when it changes, to restore on startup.
+
+  Saving is rate limited, as the flash only survives so many writes.
+  """
+  while True:
+    departures = departure_updater.departures()
+    if departures.generation != generation:
+      generation = departures.generation
+      try:
+        _save_board(departures)
+      except OSError as e:
+        sys.print_exception(e)
+    await asyncio.sleep(_BOARD_CACHE_INTERVAL)
+
+
+async def _log_metrics(departure_updater: trains.DepartureUpdater):
+  handshakes = 0
+  while True:
+    await asyncio.sleep(_METRICS_INTERVAL)
+    logging.log('Memory free: {} allocated: {}', gc.mem_free(), gc.mem_alloc())
+    tls_stats = departure_updater.tls_stats()
+    if tls_stats[0] != handshakes:
+      handshakes = tls_stats[0]
+      logging.log(
+          'TLS handshakes: {} avg: {}ms',
+          handshakes,
+          tls_stats[1] // handshakes,
+      )
+
+
+async def _run_network(
+    screen: display.Display,
+    departure_updater: trains.DepartureUpdater,
+    wlan: network.WLAN,
+    config: config_module.Config,
+    main_running: _thread.LockType,
+    thread_running: _thread.LockType,
+    saved_generation: int,
+    rendering: bool,
+):
+  """Runs all networking tasks cooperatively on this core.
+
+  The render thread is started once there are departures to show, unless
+  it's already `rendering` departures restored from flash.
+  """
+  rtt = config.rtt
+  update_scheduler = scheduler.UpdateScheduler(
+      rtt.update_interval, rtt.min_update_interval, rtt.max_update_interval
+  )
+  breaker = scheduler.CircuitBreaker(
+      _FAILURE_THRESHOLD,
+      _BACKOFF_BASE_DELAY,
+      _BACKOFF_MAX_DELAY,
+      _PROBE_INTERVAL,
+  )
+  wifi_lock = asyncio.Lock()
+  expire_task = asyncio.create_task(_expire_departures(departure_updater))
+
+  # Get first set of departures before rendering.
+  while True:
+    changed, delay = await _try_update(
+        departure_updater, wlan, config, wifi_lock, breaker
+    )
+    gc.collect()
+    if not delay:
+      break
+    await asyncio.sleep(delay)
+  update_scheduler.schedule(departure_updater.departures(), changed)
+
+  if not rendering:
+    _start_render_thread(
+        screen, departure_updater, config, main_running, thread_running
+    )
+
+  await asyncio.gather(
+      _update_departures(
+          departure_updater,
+          wlan,
+          config,
+          wifi_lock,
+          update_scheduler,
+          breaker,
+      ),
+      _supervise_wifi(departure_updater, wlan, config, wifi_lock),
+      expire_task,
+      _save_departures(departure_updater, saved_generation),
+      _log_metrics(departure_updater),
+  )
+
+
+def _start_render_thread(
+    screen: display.Display,
+    departure_updater: trains.DepartureUpdater,
+    config: config_module.Config,
+    main_running: _thread.LockType,
+    thread_running: _thread.LockType,
+):
+  logging.log('Start render loop')
+  _ = _thread.start_new_thread(
+      _render_thread,
+      (screen, departure_updater, config, main_running, thread_running),
+  )
+
+
 def run(config: config_module.Config):
   logging.log('Starting...')
 
@@ -194,6 +454,13 @@ def run(config: config_module.Config):
   try:
     main_running.acquire()
     slow_stations = set([config.slow_station]) if config.slow_station else None
+    num_departures = widgets.num_departure_rows(
+        screen,
+        fonts.BOLD_FONT,
+        fonts.TALL_FONT,
+        fonts.DEFAULT_FONT,
+        render_seconds=(config.display.type != 'epd29b'),
+    )
     departure_updater = trains.DepartureUpdater(
         config.station,
         config.destination,
@@ -204,56 +471,63 @@ def run(config: config_module.Config):
         ),
         slow_stations=slow_stations,
         min_departure_time=config.min_departure_time,
+        routes=tuple(
+            (r.station, r.destination) for r in config.additional_routes
+        ),
+        binary=config.rtt.format == 'binary',
+        batch=config.rtt.batch,
+        limit=num_departures + _SPARE_DEPARTURES,
+        proxy=config.rtt.proxy,
     )
     gc.collect()
     micropython.mem_info()
     gc.threshold(gc.mem_free() // 4 + gc.mem_alloc())
 
-    wlan = _connect(config.wifi.ssid, config.wifi.password, screen=screen)
+    # Show the last saved board straight away, while connecting in the
+    # background.
+    saved = _restore_departures(departure_updater)
+    saved_generation = departure_updater.departures().generation
+    rendering = saved >= 0
+    if rendering:
+      _start_render_thread(
+          screen, departure_updater, config, main_running, thread_running
+      )
+
+    wlan = _connect(
+        config.wifi.ssid,
+        config.wifi.password,
+        screen=None if rendering else screen,
+    )
     _configure_time()
 
+    if rendering and utils.is_time_set():
+      if time.time() - saved > _BOARD_CACHE_MAX_AGE:
+        logging.log('Saved departures are out of date, dropping them')
+        departure_updater.clear()
+      else:
+        departure_updater.expire()
+
     logging.log('Get initial train departures')
     # Don't show loading departures for e-Paper displays.
-    if config.display.type != 'epd29b':
+    if not rendering and config.display.type != 'epd29b':
       widget = widgets.MessageWidget(
           screen, _LOADING_DEPARTURES, fonts.DEFAULT_FONT
       )
       widget.render()
       screen.flush()
 
-    # Get first set of departures synchonously.
-    departure_updater.update()
-    gc.collect()
-
-    logging.log('Start render loop')
-    _ = _thread.start_new_thread(
-        _render_thread,
-        (screen, departure_updater, config, main_running, thread_running),
+    asyncio.run(
+        _run_network(
+            screen,
+            departure_updater,
+            wlan,
+            config,
+            main_running,
+            thread_running,
+            saved_generation,
+            rendering,
+        )
     )
-
-    update_interval = config.rtt.update_interval
-    logging.log('Start updating departures every {} seconds', update_interval)
-    while True:
-      for attempt in range(1, _MAX_ATTEMPTS + 1):
-        try:
-          departure_updater.update()
-          gc.collect()
-          break
-        except (OSError, ValueError) as e:
-          # Catch transient network or HTTP issues and retry
-          if isinstance(e, OSError) and e.errno == errno.ECONNABORTED:
-            logging.log('Received ECONNABORTED error, try reconnecting...')
-            _reconnect(wlan, config.wifi.ssid, config.wifi.password)
-          logging.log(
-              'Train update attempt {}/{} failed!', attempt, _MAX_ATTEMPTS
-          )
-          if attempt < _MAX_ATTEMPTS:
-            sys.print_exception(e)
-          else:
-            raise e
-
-      for _ in range(update_interval):
-        time.sleep(1)
   finally:
     logging.log('Main thread closing...')
     main_running.release()
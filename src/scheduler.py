@@ -0,0 +1,158 @@
+# Copyright (c) 2024 Tom Ward
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Module for scheduling departure updates."""
+
+import random
+import time
+
+import micropython
+
+import trains
+import utils
+
+
+# Don't back off when the next train leaves within this many seconds.
+_IMMINENT_DEPARTURE = micropython.const(5 * 60)
+# Otherwise poll at most every 1/_DEPARTURE_FRACTION of the time until it
+# leaves.
+_DEPARTURE_FRACTION = micropython.const(4)
+# Cap on how many times the interval is doubled while the board is stable.
+_MAX_BACKOFF_SHIFT = micropython.const(8)
+
+
+class UpdateScheduler:
+  """Schedules departure updates on absolute deadlines.
+
+  Deadlines advance by the chosen interval rather than restarting after each
+  update, so time spent fetching doesn't make the update period drift. The
+  interval starts at `interval` and doubles for every update that leaves the
+  board unchanged, then drops to `min_interval` as soon as the board changes.
+  While the next departure is imminent it stops backing off, but stays at
+  `interval`, so busy stations don't poll any faster than without backoff.
+  It's always kept within [`min_interval`, `max_interval`].
+  """
+
+  def __init__(self, interval: int, min_interval: int, max_interval: int):
+    self._interval = interval
+    self._min_interval = min_interval
+    self._max_interval = max_interval
+    self._stable_updates = 0
+    self._deadline = time.ticks_ms()
+
+  def schedule(self, departures: trains.DepartureTable, changed: bool) -> int:
+    """Sets the next update deadline and returns the interval in seconds."""
+    if changed:
+      self._stable_updates = 0
+      interval = self._min_interval
+    else:
+      shift = min(self._stable_updates, _MAX_BACKOFF_SHIFT)
+      self._stable_updates += 1
+      interval = self._interval << shift
+
+    next_departure = _next_departure_time(departures)
+    if next_departure is None:
+      # Nothing running, so nothing is going to change any time soon.
+      interval = self._max_interval
+    else:
+      remaining = _seconds_until(next_departure, utils.get_uk_time())
+      if remaining <= _IMMINENT_DEPARTURE:
+        interval = min(interval, self._interval)
+      else:
+        interval = min(interval, remaining // _DEPARTURE_FRACTION)
+
+    interval = max(self._min_interval, min(interval, self._max_interval))
+    now = time.ticks_ms()
+    self._deadline = time.ticks_add(self._deadline, interval * 1000)
+    if time.ticks_diff(self._deadline, now) < 0:
+      # Update overran the deadline, so start again from now rather than
+      # issuing a burst of updates to catch up.
+      self._deadline = time.ticks_add(now, interval * 1000)
+    return interval
+
+  def retry(self, delay: int):
+    """Sets the next update deadline to `delay` seconds from now."""
+    self._deadline = time.ticks_add(time.ticks_ms(), delay * 1000)
+
+  def delay_ms(self) -> int:
+    """Returns milliseconds until the next update is due."""
+    return max(0, time.ticks_diff(self._deadline, time.ticks_ms()))
+
+
+class CircuitBreaker:
+  """Backs off failing updates, and probes slowly during an outage.
+
+  Each consecutive failure doubles the retry delay, starting at `base_delay`
+  and capped at `max_delay`. Retries wait a random time of up to that delay,
+  i.e. full jitter, so devices that failed together don't retry together.
+  After `failure_threshold` consecutive failures the circuit opens, and the
+  upstream is only probed every `probe_interval` seconds until an update
+  succeeds and the circuit closes again.
+  """
+
+  def __init__(
+      self,
+      failure_threshold: int,
+      base_delay: int,
+      max_delay: int,
+      probe_interval: int,
+  ):
+    self._failure_threshold = failure_threshold
+    self._base_delay = base_delay
+    self._max_delay = max_delay
+    self._probe_interval = probe_interval
+    self._failures = 0
+
+  @property
+  def is_open(self) -> bool:
+    return self._failures >= self._failure_threshold
+
+  def succeeded(self) -> bool:
+    """Records a successful update, returns whether the circuit was open."""
+    was_open = self.is_open
+    self._failures = 0
+    return was_open
+
+  def failed(self) -> int:
+    """Records a failed update, returns seconds to wait before retrying."""
+    self._failures += 1
+    if self.is_open:
+      return self._probe_interval + random.randint(
+          0, self._probe_interval // 4
+      )
+    shift = min(self._failures - 1, _MAX_BACKOFF_SHIFT)
+    ceiling = min(self._base_delay << shift, self._max_delay)
+    # At least a second, as callers treat 0 as not needing to wait.
+    return random.randint(1, max(1, ceiling))
+
+
+def _next_departure_time(departures: trains.DepartureTable) -> int | None:
+  for i in range(len(departures)):
+    if not departures.cancelled(i):
+      return departures.actual_departure_time(i)
+  return None
+
+
+def _seconds_until(hh_mm: int, now: tuple[int, ...]) -> int:
+  """Returns seconds from `now` until the [h]h[m]m time, wrapping midnight."""
+  hh, mm = divmod(hh_mm, 100)
+  minutes = (hh * 60 + mm - now[3] * 60 - now[4]) % (24 * 60)
+  if minutes > 12 * 60:
+    # Departure time has already passed, e.g. the train is running late.
+    return 0
+  return minutes * 60 - now[5]
@@ -18,25 +18,40 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """Module for communicating with RTT API."""
 
+import array
+import asyncio
 import binascii
-import collections
+import deflate
 import errno
+import io
 import json
 import gc
-import select
 import socket
 import ssl
+import struct
 import time
-import _thread
+
+import micropython
 
 import utils
 
 
 _REQUEST_TIMEOUT = 10
 _MAXRESPONSE_SIZE = 40 * 1024
+# Departures are parsed as they're streamed, so the buffer only needs to fit
+# the largest single value in the response, e.g. one service.
+_STREAM_BUFFER_SIZE = 16 * 1024
+
+# Maximum number of departures kept per update, in time order.
+_MAX_DEPARTURES = micropython.const(16)
+# Number of distinct destination names interned for each route, before
+# starting again.
+_MAX_DESTINATIONS = micropython.const(64)
 
 
-def _calculate_departure_datetime(service) -> int:
+def _calculate_departure_datetime(
+    run_date: tuple[int, int, int], departure_time: int, origin_time: int
+) -> int:
   """Utility to calculate the full datetime in seconds.
 
   Because RTT only provides the service's origin date and not the date at the
@@ -44,16 +59,9 @@ def _calculate_departure_datetime(service) -> int:
 
   We assume that services do not run for > 24hrs.
   """
-  yyyy, month, dd = map(int, service['runDate'].split('-'))
-
-  location = service['locationDetail']
-  departure_time = int(location['gbttBookedDeparture'])
-  if location.get('cancelReasonCode') is not None:
-    departure_time = int(location.get('realtimeDeparture', departure_time))
-
+  yyyy, month, dd = run_date
   hh, mm = divmod(departure_time, 100)
-
-  origin_hh, origin_mm = divmod(int(location['origin'][0]['publicTime']), 100)
+  origin_hh, origin_mm = divmod(origin_time, 100)
   full_origin_departure_datetime = time.mktime(
       (yyyy, month, dd, origin_hh, origin_mm, 0, 0, 0)
   )
@@ -99,25 +107,441 @@ def make_basic_auth(username: str, password: str):
   return auth
 
 
-def _http_request(
-    url: str,
-    *,
-    basic_auth: str | None = None,
-    timeout: int | None = None,
-    buffer: memoryview | None = None,
-    ssl_context: ssl.SSLContext | None = None,
-) -> Response:
-  """Send HTTP GET request and return Response.
+class _Connection:
+  """Persistent HTTP/1.1 connection, reused across requests to the same host.
 
-  This is heavily influenced by urequests.get(), with a couple of modifications:
-    - Simplify code by not supporting sending params with GET
-    - Support passing a pre-allocated buffer for response body, to help
-      alleviate memory fragmentation.
-    - Fix for transient EINPROGRESS error thrown from connect when using
-      timeouts.
+  Keeping the socket open between polls avoids repeating DNS, TCP connect and
+  most importantly the TLS handshake, which dominates request time on a Pico.
+  The connection is transparently re-established if the server closes it, or
+  after any error.
+
+  The socket is non-blocking and driven by asyncio, so that other tasks keep
+  running while connecting, handshaking or waiting for a response. Each phase
+  of a request has its own deadline.
   """
+
+  def __init__(self, ssl_context: ssl.SSLContext | None = None):
+    if ssl_context is None:
+      ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    self._ssl_context = ssl_context
+    self._socket = None
+    self._stream = None
+    self._address = None
+    # MicroPython has no non-blocking getaddrinfo(), so only resolve each host
+    # once rather than blocking the event loop on every reconnect.
+    self._addresses = {}
+
+    # MicroPython's ssl module (as of v1.22) can't resume TLS sessions, so
+    # every reconnect is a full handshake. Keeping the connection alive is the
+    # only way to avoid them, so count them to see how often that fails.
+    self._handshake_start = None
+    self.handshakes = 0
+    self.handshake_ms = 0
+
+  def close(self):
+    if self._socket is not None:
+      self._socket.close()
+      self._socket = None
+      self._stream = None
+      self._handshake_start = None
+
+  def _connect(self, proto: str, host: str, port: int):
+    """Starts connecting to host.
+
+    Connecting and the TLS handshake complete asynchronously, as the first
+    request is written to the stream.
+    """
+    addr = self._addresses.get(host)
+    if addr is None:
+      addr = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+      self._addresses[host] = addr
+
+    s = socket.socket(addr[0], socket.SOCK_STREAM, addr[2])
+    try:
+      s.setblocking(False)
+      try:
+        s.connect(addr[-1])
+      except OSError as e:
+        if e.errno != errno.EINPROGRESS:
+          raise
+
+      if proto == 'https:':
+        s = self._wrap_socket(s, host)
+    except Exception:
+      s.close()
+      # Resolve again next time, in case the host has moved.
+      self._addresses.pop(host, None)
+      raise
+
+    self._socket = s
+    self._stream = asyncio.StreamWriter(s, {})
+    self._address = (proto, host, port)
+
+  def _wrap_socket(self, s, host: str):
+    """Wraps socket with TLS, handshaking as the first request is written."""
+    self._handshake_start = time.ticks_ms()
+    return self._ssl_context.wrap_socket(
+        s, server_hostname=host, do_handshake_on_connect=False
+    )
+
+  def _handshake_complete(self):
+    self.handshakes += 1
+    self.handshake_ms += time.ticks_diff(time.ticks_ms(), self._handshake_start)
+    self._handshake_start = None
+
+  async def request(
+      self,
+      proto: str,
+      host: str,
+      port: int,
+      path: str,
+      *,
+      basic_auth: str | None = None,
+      headers: dict[str, str] | None = None,
+      timeout: int | None = None,
+      buffer: memoryview | None = None,
+      consumer=None,
+  ) -> Response:
+    """Sends GET request, reusing the open socket where possible.
+
+    If `consumer` is provided, it's awaited with a stream over the body of a
+    successful (200) response and the buffer to read it with, rather than
+    reading the body into `buffer`. The response's content is then whatever
+    `consumer` returns.
+
+    `timeout` applies separately to connecting and sending the request,
+    receiving the response headers, and reading the body.
+    """
+    responses = await self.pipeline(
+        proto,
+        host,
+        port,
+        ((path, headers),),
+        basic_auth=basic_auth,
+        timeout=timeout,
+        buffer=buffer,
+        consumers=(consumer,),
+    )
+    return responses[0]
+
+  async def pipeline(
+      self,
+      proto: str,
+      host: str,
+      port: int,
+      requests,
+      *,
+      basic_auth: str | None = None,
+      timeout: int | None = None,
+      buffer: memoryview | None = None,
+      consumers=None,
+  ) -> list[Response]:
+    """Sends several GET requests at once, then reads their responses in order.
+
+    `requests` is a sequence of (path, headers) tuples, and `consumers` an
+    optional consumer for each, see `request()`. Pipelining sends every
+    request in one round trip, so several small requests take little longer
+    than one. Each response is read fully before the next, so they can all
+    share `buffer`, and non-consumed content is only valid until the next
+    response is read.
+
+    If the server closes the connection part way through, any requests left
+    unanswered are sent again on a new connection.
+    """
+    responses = []
+    retried = False
+    while len(responses) < len(requests):
+      if self._address != (proto, host, port):
+        self.close()
+
+      reused = self._socket is not None
+      if not reused:
+        self._connect(proto, host, port)
+
+      try:
+        for i in range(len(responses), len(requests)):
+          path, headers = requests[i]
+          self._write_request(host, path, basic_auth, headers)
+
+        # Connecting and the TLS handshake happen as the requests are sent.
+        await asyncio.wait_for(self._stream.drain(), timeout)
+        if self._handshake_start is not None:
+          self._handshake_complete()
+
+        for i in range(len(responses), len(requests)):
+          responses.append(
+              await self._read_response(
+                  timeout, buffer, consumers[i] if consumers else None
+              )
+          )
+          if self._socket is None:
+            break
+      except OSError as e:
+        self.close()
+        # The server may have closed an idle connection since it was last
+        # used, in which case retry once on a new connection.
+        if not reused or retried or e.errno not in _STALE_CONNECTION_ERRORS:
+          raise
+        retried = True
+      except BaseException:
+        # Includes being cancelled, e.g. by a deadline, which leaves the
+        # connection part way through a request.
+        self.close()
+        raise
+
+    return responses
+
+  def _write_request(
+      self,
+      host: str,
+      path: str,
+      basic_auth: str | None,
+      request_headers: dict[str, str] | None,
+  ):
+    # Write request in one go, so that it's sent as a single TLS record.
+    request = 'GET /{} HTTP/1.1\r\nHost: {}\r\n'.format(path, host)
+    if basic_auth is not None:
+      request += 'Authorization: Basic {}\r\n'.format(basic_auth)
+    if request_headers:
+      for k, v in request_headers.items():
+        request += '{}: {}\r\n'.format(k, v)
+    # Not gzip, which would need a 32KB inflate window, see _Inflater.
+    request += 'Accept-Encoding: deflate\r\n'
+    self._stream.write(request + 'Connection: keep-alive\r\n\r\n')
+
+  async def _read_response(
+      self, timeout: int | None, buffer: memoryview | None, consumer
+  ) -> Response:
+    stream = self._stream
+    version, status, headers = await asyncio.wait_for(
+        _read_headers(stream), timeout
+    )
+    keep_alive = version == b'HTTP/1.1'
+    connection = headers.get('connection', '').lower()
+    if connection == 'close':
+      keep_alive = False
+    elif connection == 'keep-alive':
+      keep_alive = True
+
+    if consumer is not None and status != 200:
+      consumer = None
+    if buffer is None:
+      buffer = memoryview(bytearray(_MAXRESPONSE_SIZE))
+
+    encoding = headers.get('content-encoding', 'identity').lower()
+    if status == 204 or status == 304 or 100 <= status <= 199:
+      body = _BodyReader(stream, 0)
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+      body = _BodyReader(stream, 0, chunked=True)
+    elif 'content-length' in headers:
+      content_length = int(headers['content-length'])
+      if (
+          encoding == 'identity'
+          and consumer is None
+          and len(buffer) < content_length
+      ):
+        raise ValueError(
+            'Content length > buffer! Content-length: {} Buffer {}'.format(
+                content_length, len(buffer)
+            )
+        )
+      body = _BodyReader(stream, content_length)
+    else:
+      # Body is delimited by the server closing the connection.
+      keep_alive = False
+      body = _BodyReader(stream, -1)
+
+    content = await asyncio.wait_for(
+        _read_content(body, encoding, buffer, consumer), timeout
+    )
+    if not keep_alive:
+      self.close()
+
+    return Response(status, headers, content)
+
+
+# Errors that indicate a kept-alive socket was closed by the server.
+_STALE_CONNECTION_ERRORS = (
+    errno.ECONNRESET,
+    errno.ECONNABORTED,
+    errno.ENOTCONN,
+    errno.EPIPE,
+)
+
+# Scratch buffer for reading data that's going to be discarded.
+_SCRATCH = bytearray(64)
+
+
+async def _read_headers(stream) -> tuple[bytes, int, dict[str, str]]:
+  """Reads status line and headers, returning HTTP version, status & headers."""
+  line = await stream.readline()
+  if not line:
+    raise OSError(errno.ECONNRESET, 'Connection closed by server.')
+  http_status = line.split(None, 2)
+  if len(http_status) < 2:
+    raise ValueError('HTTP error: bad status "{}"'.format(http_status))
+  status = int(http_status[1])
+
+  # Parse response headers, lower-casing names as they're case-insensitive.
+  headers = {}
+  while True:
+    header = await stream.readline()
+    if not header or header == b'\r\n':
+      break
+    header = str(header, 'utf-8')
+    k, v = header.split(':', 1)
+    headers[k.lower()] = v.strip()
+  return http_status[0], status, headers
+
+
+class _BodyReader:
+  """Stream over a response body that undoes any chunked framing.
+
+  Reads stop at the end of the body rather than the end of the socket, so that
+  the connection can be reused for the next request.
+  """
+
+  def __init__(self, stream, content_length: int, *, chunked: bool = False):
+    self._stream = stream
+    self._chunked = chunked
+    self._first_chunk = True
+    # Bytes left in the body (or current chunk), or -1 if the body is
+    # delimited by the server closing the connection.
+    self._remaining = 0 if chunked else content_length
+    self._done = not chunked and content_length == 0
+
+  async def readinto(self, buf) -> int:
+    if self._done:
+      return 0
+    if self._remaining == 0 and not await self._next_chunk():
+      return 0
+
+    if 0 < self._remaining < len(buf):
+      buf = memoryview(buf)[: self._remaining]
+    n = None
+    while n is None:
+      # None means the socket was readable, but a whole TLS record wasn't.
+      n = await self._stream.readinto(buf)
+    if not n:
+      if self._remaining < 0:
+        self._done = True
+        return 0
+      raise OSError(errno.ECONNRESET, 'Connection closed reading response.')
+
+    if self._remaining > 0:
+      self._remaining -= n
+      self._done = self._remaining == 0 and not self._chunked
+    return n
+
+  async def _next_chunk(self) -> bool:
+    stream = self._stream
+    if not self._first_chunk:
+      await stream.readline()  # Consume CRLF at the end of the previous chunk.
+    self._first_chunk = False
+
+    line = await stream.readline()
+    if not line:
+      raise OSError(errno.ECONNRESET, 'Connection closed reading response.')
+    self._remaining = int(line.split(b';', 1)[0].strip(), 16)
+    if self._remaining > 0:
+      return True
+
+    # Last chunk, so consume any trailer headers.
+    while True:
+      line = await stream.readline()
+      if not line or line == b'\r\n':
+        break
+    self._done = True
+    return False
+
+  async def drain(self):
+    """Reads and discards the rest of the body."""
+    await _drain(self)
+
+
+class _Inflater:
+  """Stream that decompresses a deflate or gzip stream held in memory.
+
+  Gzip doesn't record its window size, so needs the maximum 32KB window. Zlib
+  streams (i.e. "deflate") do, and the proxy compresses with a much smaller
+  window, so only deflate is requested. Gzip is still handled in case a server
+  sends it anyway.
+  """
+
+  def __init__(self, source, encoding: str):
+    if encoding == 'gzip':
+      self._stream = deflate.DeflateIO(source, deflate.GZIP, 15)
+    else:
+      self._stream = deflate.DeflateIO(source, deflate.ZLIB)
+
+  async def readinto(self, buf) -> int:
+    return self._stream.readinto(buf)
+
+
+class _MemoryReader(io.IOBase):
+  """Synchronous stream over data already in memory, without copying it."""
+
+  def __init__(self, data: memoryview):
+    self._data = data
+    self._pos = 0
+
+  def readinto(self, buf) -> int:
+    n = min(len(buf), len(self._data) - self._pos)
+    buf[:n] = self._data[self._pos : self._pos + n]
+    self._pos += n
+    return n
+
+
+async def _drain(stream):
+  while await stream.readinto(_SCRATCH):
+    pass
+
+
+async def _read_body(stream, buffer: memoryview) -> int:
+  """Reads whole stream into buffer, returning its length."""
+  offset = 0
+  while offset < len(buffer):
+    n = await stream.readinto(buffer[offset:])
+    if not n:
+      return offset
+    offset += n
+
+  # Buffer is full, so make sure there's no more data we'd otherwise truncate.
+  if await stream.readinto(memoryview(_SCRATCH)[:1]):
+    raise ValueError('Response larger than buffer {}'.format(len(buffer)))
+  return offset
+
+
+async def _read_content(
+    body: _BodyReader, encoding: str, buffer: memoryview | None, consumer
+):
+  if encoding == 'identity':
+    stream = body
+  elif encoding == 'gzip' or encoding == 'deflate':
+    # DeflateIO can only read from a synchronous stream, so buffer the
+    # compressed body at the start of the buffer, and inflate it from there
+    # into the rest of the buffer.
+    length = await _read_body(body, buffer)
+    stream = _Inflater(_MemoryReader(buffer[:length]), encoding)
+    buffer = buffer[length:]
+  else:
+    raise ValueError('Unsupported content encoding: {}'.format(encoding))
+
+  if consumer is not None:
+    content = await consumer(stream, buffer)
+    # Consume whatever the consumer didn't need, so the connection is ready
+    # for the next request.
+    await _drain(stream)
+  else:
+    content = buffer[: await _read_body(stream, buffer)]
+  # Consume any framing left after the end of a compressed stream.
+  await body.drain()
+  return content
+
+
+def _split_url(url: str) -> tuple[str, str, int, str]:
+  """Splits URL into its protocol, host, port and path."""
   proto, _, host, path = url.split('/', 3)
-  redirect = None
 
   if proto == 'http:':
     port = 80
@@ -129,157 +553,895 @@ def _http_request(
   if ':' in host:
     host, port = host.split(':', 1)
     port = int(port)
+  return proto, host, port, path
 
-  addr = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
 
-  s = socket.socket(addr[0], socket.SOCK_STREAM, addr[2])
-
-  try:
-    s.connect(addr[-1])
-
-    p = select.poll()
-    p.register(s, select.POLLOUT)
-    result = p.poll(timeout if timeout is not None else -1)
-    if not result:
-      raise OSError(errno.ETIMEDOUT, 'Timed out connecting to socket.')
-
-    if timeout is not None:
-      s.settimeout(timeout)
-
-    if proto == 'https:':
-      if ssl_context is not None:
-        s = ssl_context.wrap_socket(s, server_hostname=host)
-      else:
-        s = ssl.wrap_socket(s, server_hostname=host)
-
-    s.write('GET /{} HTTP/1.0\r\n'.format(path))
-    s.write('Host: {}\r\n'.format(host))
-    if basic_auth is not None:
-      s.write('Authorization: Basic {}\r\n'.format(basic_auth))
-    s.write('Connection: close\r\n\r\n')
+async def _http_request(
+    url: str,
+    *,
+    basic_auth: str | None = None,
+    headers: dict[str, str] | None = None,
+    timeout: int | None = None,
+    buffer: memoryview | None = None,
+    ssl_context: ssl.SSLContext | None = None,
+    connection: _Connection | None = None,
+    consumer=None,
+) -> Response:
+  """Send HTTP GET request and return Response.
 
-    http_status = s.readline().split(None, 2)
-    if len(http_status) < 2:
-      raise ValueError('HTTP error: bad status "{}"'.format(http_status))
+  This is heavily influenced by urequests.get(), with a couple of modifications:
+    - Simplify code by not supporting sending params with GET
+    - Support passing a pre-allocated buffer for response body, to help
+      alleviate memory fragmentation.
+    - Non-blocking, with separate timeouts for each phase of the request.
+    - Support reusing a persistent connection across requests.
+    - Support streaming the response body to a consumer, so that it can be
+      larger than any buffer.
+  """
+  proto, host, port, path = _split_url(url)
 
-    status = int(http_status[1])
+  owns_connection = connection is None
+  if owns_connection:
+    connection = _Connection(ssl_context)
 
-    # Parse response headers.
-    headers = {}
-    while True:
-      header = s.readline()
-      if not header or header == b'\r\n':
-        break
-      if header.startswith(b'Location:') and not 200 <= status <= 299:
-        if status in [301, 302, 303, 307, 308]:
-          redirect = str(header[10:-2], 'utf-8')
-        else:
-          raise NotImplementedError('Redirect %d not yet supported!' % status)
-      else:
-        header = str(header, 'utf-8')
-        k, v = header.split(':', 1)
-        headers[k] = v.strip()
-
-  except Exception:
-    # Always close socket on any exception
-    s.close()
-    raise
-
-  if redirect is not None:
-    s.close()
-    _http_request(
+  try:
+    response = await connection.request(
+        proto,
+        host,
+        port,
+        path,
+        basic_auth=basic_auth,
+        headers=headers,
+        timeout=timeout,
+        buffer=buffer,
+        consumer=consumer,
+    )
+  finally:
+    if owns_connection:
+      connection.close()
+
+  if response.status_code in (301, 302, 303, 307, 308):
+    redirect = response.headers.get('location')
+    if redirect is None:
+      raise ValueError(
+          'Redirect {} missing location!'.format(response.status_code)
+      )
+    return await _http_request(
         redirect,
         basic_auth=basic_auth,
+        headers=headers,
         timeout=timeout,
         buffer=buffer,
         ssl_context=ssl_context,
+        connection=connection if not owns_connection else None,
+        consumer=consumer,
     )
 
-  try:
-    if buffer is not None:
-      content_length = int(headers.get('Content-Length', -1))
-      if content_length > -1 and len(buffer) < content_length:
+  return response
+
+
+async def _http_pipeline(
+    urls: list[str],
+    *,
+    basic_auth: str | None = None,
+    headers=None,
+    timeout: int | None = None,
+    buffer: memoryview | None = None,
+    connection: _Connection,
+    consumers=None,
+) -> list[Response]:
+  """Sends GET requests to URLs on the same host, pipelined on `connection`.
+
+  `headers` and `consumers`, if provided, have an entry for each URL. Any
+  redirects are then followed one at a time.
+  """
+  proto, host, port, _ = _split_url(urls[0])
+  requests = []
+  for i in range(len(urls)):
+    url_proto, url_host, url_port, path = _split_url(urls[i])
+    if (url_proto, url_host, url_port) != (proto, host, port):
+      raise ValueError('Can only pipeline requests to one host: ' + urls[i])
+    requests.append((path, headers[i] if headers else None))
+
+  responses = await connection.pipeline(
+      proto,
+      host,
+      port,
+      requests,
+      basic_auth=basic_auth,
+      timeout=timeout,
+      buffer=buffer,
+      consumers=consumers,
+  )
+  for i in range(len(responses)):
+    response = responses[i]
+    if response.status_code in (301, 302, 303, 307, 308):
+      redirect = response.headers.get('location')
+      if redirect is None:
         raise ValueError(
-            'Content length > buffer! Content-length: {} Buffer {}'.format(
-                content_length, len(buffer)
-            )
+            'Redirect {} missing location!'.format(response.status_code)
         )
-      else:
-        length = s.readinto(buffer)
-        content = buffer[:length]
+      responses[i] = await _http_request(
+          redirect,
+          basic_auth=basic_auth,
+          headers=headers[i] if headers else None,
+          timeout=timeout,
+          buffer=buffer,
+          connection=connection,
+          consumer=consumers[i] if consumers else None,
+      )
+  return responses
+
+
+_QUOTE = micropython.const(0x22)
+_BACKSLASH = micropython.const(0x5C)
+_COMMA = micropython.const(0x2C)
+_COLON = micropython.const(0x3A)
+
+
+@micropython.viper
+def _skip_whitespace(buf: ptr8, pos: int, end: int) -> int:  # type: ignore
+  while pos < end:
+    c = buf[pos]
+    if c != 0x20 and c != 0x0A and c != 0x0D and c != 0x09:
+      return pos
+    pos += 1
+  return pos
+
+
+@micropython.viper
+def _skip_string(buf: ptr8, pos: int, end: int) -> int:  # type: ignore
+  """Returns the index after the closing quote of the string at `pos`."""
+  pos += 1
+  while pos < end:
+    c = buf[pos]
+    if c == 0x5C:  # Backslash, so skip escaped character.
+      pos += 2
+    elif c == 0x22:
+      return pos + 1
     else:
-      content = s.read()
-  finally:
-    s.close()
+      pos += 1
+  return -1
+
+
+@micropython.viper
+def _skip_value(buf: ptr8, pos: int, end: int) -> int:  # type: ignore
+  """Returns the index after the JSON value that starts at `pos`."""
+  depth = 0
+  while pos < end:
+    c = buf[pos]
+    if c == 0x22:  # Quote, skip string including any escaped quotes.
+      pos += 1
+      while pos < end:
+        c = buf[pos]
+        if c == 0x5C:
+          pos += 1
+        elif c == 0x22:
+          break
+        pos += 1
+      if pos >= end:
+        return -1
+    elif c == 0x7B or c == 0x5B:  # { or [
+      depth += 1
+    elif c == 0x7D or c == 0x5D:  # } or ]
+      if depth == 0:
+        return pos
+      depth -= 1
+    elif c == 0x2C and depth == 0:  # Comma terminates value at this level.
+      return pos
+    pos += 1
+    if depth == 0 and (c == 0x22 or c == 0x7D or c == 0x5D):
+      return pos
+  return -1
+
+
+@micropython.viper
+def _contains(buf: ptr8, start: int, stop: int, c: int) -> bool:  # type: ignore
+  for i in range(start, stop):
+    if buf[i] == c:
+      return True
+  return False
+
+
+@micropython.viper
+def _move(buf: ptr8, dst: int, src: int, n: int):  # type: ignore
+  """Moves bytes towards the start of buf, where dst < src."""
+  for i in range(n):
+    buf[dst + i] = buf[src + i]
+
+
+@micropython.viper
+def _equals(buf: ptr8, pos: int, value: ptr8, n: int) -> bool:  # type: ignore
+  for i in range(n):
+    if buf[pos + i] != value[i]:
+      return False
+  return True
+
+
+@micropython.viper
+def _hash(buf: ptr8, start: int, stop: int) -> int:  # type: ignore
+  """FNV-1a hash of buf[start:stop], truncated to fit in a small int."""
+  h = 0x011C9DC5  # FNV offset basis, truncated.
+  for i in range(start, stop):
+    h = ((h ^ buf[i]) * 0x01000193) & 0x3FFFFFFF
+  return h
+
+
+class _JsonReader:
+  """Minimal pull-parser that walks a JSON document in a buffer.
+
+  Unlike json.loads(), this doesn't build any intermediate dicts or lists.
+  Callers walk the document, comparing keys in-place and only allocating for
+  the values they actually need, skipping everything else.
+
+  If a stream is provided, the buffer is used as a sliding window over it:
+  consumed data is discarded and the window refilled as parsing progresses,
+  so the document can be much larger than the buffer. Reading the stream is
+  asynchronous, so the fetch_*() methods make sure a whole value is buffered,
+  which can then be parsed synchronously. Only a single value needs to fit in
+  the buffer at once.
+  """
 
-  return Response(status, headers, content)
+  def __init__(self, buf: memoryview, stream=None):
+    self._buf = buf
+    self._stream = stream
+    self._end = len(buf) if stream is None else 0
+    self._pos = 0
+    self._start = 0
+    self._stop = 0
+
+  async def _fill(self, mark: int) -> bool:
+    """Discards data before `mark`, then reads more data from the stream."""
+    if self._stream is None:
+      return False
+
+    keep = self._end - mark
+    if keep == len(self._buf):
+      raise ValueError('JSON value larger than buffer {}'.format(keep))
+    _move(self._buf, 0, mark, keep)
+    self._pos -= mark
+    self._start -= mark
+    self._stop -= mark
+    self._end = keep
+
+    n = await self._stream.readinto(self._buf[keep:])
+    if not n:
+      return False
+    self._end += n
+    return True
+
+  async def fill(self, keep_key: bool = False):
+    """Makes sure the next non-whitespace character is buffered."""
+    self._pos = _skip_whitespace(self._buf, self._pos, self._end)
+    while self._pos >= self._end:
+      if not await self._fill(self._start - 1 if keep_key else self._pos):
+        raise ValueError('Unexpected end of JSON')
+      self._pos = _skip_whitespace(self._buf, self._pos, self._end)
+
+  async def fetch_value(self):
+    """Makes sure the whole of the next value is buffered."""
+    await self.fill()
+    while _skip_value(self._buf, self._pos, self._end) < 0:
+      if not await self._fill(self._pos):
+        raise ValueError('Unexpected end of JSON')
+
+  async def fetch_key(self) -> bool:
+    """Buffers and moves to the next key of the current object, if any."""
+    await self.fill()
+    if not self._next(0x7D):
+      return False
+    await self.fetch_value()
+    self._span()
+    # Don't discard the key if we have to refill before reaching the colon.
+    await self.fill(keep_key=True)
+    self._expect(_COLON)
+    return True
+
+  async def fetch_item(self) -> bool:
+    """Buffers the whole of the next item of the current array, if any."""
+    await self.fill()
+    if not self._next(0x5D):
+      return False
+    await self.fetch_value()
+    return True
+
+  async def begin_item(self) -> bool:
+    """Moves to the next item of the current array, without buffering it."""
+    await self.fill()
+    return self.next_item()
+
+  async def fetch_array(self) -> bool:
+    """Begins the next array, returning False (and skipping it) if null."""
+    await self.fill()
+    if self._buf[self._pos] == 0x6E:  # n
+      await self.fetch_value()
+      self.skip()
+      return False
+    self.begin_array()
+    return True
+
+  def _peek(self) -> int:
+    self._pos = _skip_whitespace(self._buf, self._pos, self._end)
+    if self._pos >= self._end:
+      raise ValueError('Unexpected end of JSON')
+    return self._buf[self._pos]
+
+  def _value_end(self) -> int:
+    self._peek()
+    end = _skip_value(self._buf, self._pos, self._end)
+    if end < 0:
+      raise ValueError('Unexpected end of JSON')
+    return end
+
+  def _expect(self, c: int):
+    if self._peek() != c:
+      raise ValueError(
+          'Malformed JSON! Expected "{}" at {}'.format(chr(c), self._pos)
+      )
+    self._pos += 1
+
+  def _span(self):
+    """Reads next string, storing its (unquoted) bounds."""
+    self._expect(_QUOTE)
+    self._start = self._pos
+    end = _skip_string(self._buf, self._pos - 1, self._end)
+    if end < 0:
+      raise ValueError('Unterminated JSON string at {}'.format(self._start))
+    self._stop = end - 1
+    self._pos = end
+
+  def _next(self, close: int) -> bool:
+    c = self._peek()
+    if c == close:
+      self._pos += 1
+      return False
+    if c == _COMMA:
+      self._pos += 1
+    return True
+
+  def begin_object(self):
+    self._expect(0x7B)
+
+  def begin_array(self):
+    self._expect(0x5B)
+
+  def next_key(self) -> bool:
+    """Moves to the next key of the current object, if there is one."""
+    if not self._next(0x7D):
+      return False
+    self._span()
+    self._expect(_COLON)
+    return True
+
+  def next_item(self) -> bool:
+    """Moves to the next item of the current array, if there is one."""
+    return self._next(0x5D)
+
+  def key_is(self, key: bytes) -> bool:
+    """Whether the current key equals `key`, without allocating."""
+    return self._stop - self._start == len(key) and _equals(
+        self._buf, self._start, key, len(key)
+    )
+
+  def skip(self):
+    self._pos = self._value_end()
+
+  def null(self) -> bool:
+    """Consumes the next value iff it's null."""
+    if self._peek() == 0x6E:  # n
+      self._pos = self._value_end()
+      return True
+    return False
+
+  def string(self) -> str:
+    self._span()
+    return self.last_string()
+
+  def last_string(self) -> str:
+    """Decodes the string most recently consumed."""
+    if _contains(self._buf, self._start, self._stop, _BACKSLASH):
+      # Escaped strings are rare, so leave decoding them to json.
+      return json.loads(bytes(self._buf[self._start - 1 : self._pos]))
+    return str(self._buf[self._start : self._stop], 'utf-8')
+
+  def boolean(self) -> bool:
+    """Reads a boolean, treating null as False."""
+    value = self._peek() == 0x74  # t
+    self._pos = self._value_end()
+    return value
+
+  def string_index(self, values, count: int) -> int:
+    """Consumes next string, returning its index in `values[:count]` or -1."""
+    self._span()
+    length = self._stop - self._start
+    for i in range(count):
+      value = values[i]
+      if length == len(value) and _equals(
+          self._buf, self._start, value, length
+      ):
+        return i
+    return -1
+
+  def string_hash(self) -> int:
+    """Consumes next string, returning a hash of its raw bytes.
+
+    Empty strings return 0, so that they're never matched, see
+    `DepartureTable.merge()`.
+    """
+    self._span()
+    if self._start == self._stop:
+      return 0
+    return _hash(self._buf, self._start, self._stop)
+
+  def last_raw_string(self) -> bytes:
+    """Returns the undecoded bytes of the string most recently consumed."""
+    return bytes(self._buf[self._start : self._stop])
+
+  def integer(self) -> int:
+    """Reads an integer, which RTT often encodes as a string e.g. "0915"."""
+    if self._peek() == _QUOTE:
+      self._span()
+      start, stop = self._start, self._stop
+    else:
+      stop = self._value_end()
+      start, self._pos = self._pos, stop
+    return self._to_int(start, stop)
+
+  def date(self) -> tuple[int, int, int]:
+    """Reads a YYYY-MM-DD date string."""
+    self._span()
+    start = self._start
+    if self._stop - start != 10:
+      raise ValueError('Malformed date at {}'.format(start))
+    return (
+        self._to_int(start, start + 4),
+        self._to_int(start + 5, start + 7),
+        self._to_int(start + 8, start + 10),
+    )
 
+  def _to_int(self, start: int, stop: int) -> int:
+    buf = self._buf
+    value = 0
+    for i in range(start, stop):
+      digit = buf[i] - 0x30
+      if not 0 <= digit <= 9:
+        raise ValueError('Malformed integer at {}'.format(start))
+      value = value * 10 + digit
+    return value
+
+
+# Fields of each packed departure record in a DepartureTable.
+_DEPARTURE_TIME = micropython.const(0)
+_ACTUAL_DEPARTURE_TIME = micropython.const(1)
+_FLAGS = micropython.const(2)
+# Key identifying the service, split across two fields.
+_SERVICE_HIGH = micropython.const(3)
+_SERVICE_LOW = micropython.const(4)
+# Expected departure in seconds since the epoch, split across two fields.
+_EPOCH_HIGH = micropython.const(5)
+_EPOCH_LOW = micropython.const(6)
+_RECORD_SIZE = micropython.const(7)
+
+# Binary form of a DepartureTable, see DepartureTable.dump(). The header is
+# followed by each name as a length-prefixed UTF-8 string, starting with the
+# table's name, then each departure.
+_DUMP_MAGIC = b'PTD1'
+_DUMP_HEADER = '<4sIBB'
+_DUMP_DEPARTURE = '<HHBBII'
+
+# Bits of the _FLAGS field, with the destination index stored above them.
+_CANCELLED = micropython.const(1)
+_FAST_TRAIN = micropython.const(2)
+_DESTINATION_SHIFT = micropython.const(2)
+
+
+class _Destinations:
+  """Interned destination names, so that updates don't allocate new strings.
+
+  Slots are preallocated and only ever appended to, so a table being parsed
+  can share names with a table being rendered on the other core.
+  """
 
-# TODO: Make this a dataclass when MicroPython supports dataclasses
-class Departure:
-  """Class that encapsulates a train departure's data to be displayed."""
+  def __init__(self, capacity: int = _MAX_DESTINATIONS):
+    self._names = [None] * capacity
+    self._raw_names = [None] * capacity
+    self._size = 0
+
+  def nearly_full(self, routes: int = 1) -> bool:
+    """Returns whether updating `routes` routes might run out of slots."""
+    return self._size > len(self._names) - _MAX_DEPARTURES * routes
+
+  def name(self, index: int) -> str:
+    return self._names[index]
+
+  def read(self, reader: '_JsonReader') -> int:
+    """Consumes next string from `reader`, returning its interned index."""
+    index = reader.string_index(self._raw_names, self._size)
+    if index < 0:
+      index = self.intern(reader.last_string(), reader.last_raw_string())
+    return index
+
+  def read_bytes(self, buf: memoryview, start: int, stop: int) -> int:
+    """Returns interned index of UTF-8 encoded name in buf[start:stop]."""
+    length = stop - start
+    for i in range(self._size):
+      raw_name = self._raw_names[i]
+      if length == len(raw_name) and _equals(buf, start, raw_name, length):
+        return i
+    raw_name = bytes(buf[start:stop])
+    return self.intern(str(raw_name, 'utf-8'), raw_name)
+
+  def intern(self, name: str, raw_name: bytes | None = None) -> int:
+    for i in range(self._size):
+      if self._names[i] == name:
+        return i
+    if self._size == len(self._names):
+      raise ValueError('Too many destinations!')
+    index = self._size
+    self._names[index] = name
+    self._raw_names[index] = raw_name if raw_name else name.encode()
+    self._size += 1
+    return index
+
+
+class DepartureTable:
+  """Fixed-capacity table of departures, packed into an array.
+
+  Each departure is a record of booked and actual [h]h[m]m departure times,
+  flags, an index into an interned table of destination names, a key
+  identifying the service, and when it's expected to depart in seconds since
+  the epoch. Tables are reused across updates, so polling
+  doesn't allocate per departure.
+
+  Published tables carry a `generation` that increments each time the
+  departures change, plus a `changed_rows` bitmask of rows that differ from
+  the previous generation.
+
+  Tables are handed between the network and render threads without locks. A
+  table is only written once it's no longer published, but a reader may still
+  be part way through reading it, so readers must check that `sequence` is
+  even and unchanged once they're done, otherwise the read may be torn:
+
+    sequence = departures.sequence
+    ...
+    if not departures.unchanged_since(sequence):
+      # Retry with the latest table.
+  """
 
-  def __init__(
+  def __init__(self, name: str, destinations: _Destinations | None = None):
+    self.name = name
+    self.generation = 0
+    # Nothing has been rendered yet, so treat every row as changed.
+    self.changed_rows = -1
+    # Odd while the table is being written.
+    self.sequence = 0
+    # Number of departures added, updated, moved or removed by the last merge.
+    self.changes = 0
+    # When departures restored from flash were saved, until they're fetched
+    # again, otherwise 0.
+    self.stale_since = 0
+    self._records = array.array('H', [0] * (_RECORD_SIZE * _MAX_DEPARTURES))
+    self._size = 0
+    self._cursor = 0
+    self._destinations = destinations if destinations else _Destinations()
+    # Index of each row's service in the previous generation.
+    self._previous_rows = bytearray(_MAX_DEPARTURES)
+
+  def begin_write(self):
+    self.sequence += 1
+
+  def end_write(self):
+    self.sequence += 1
+
+  def unchanged_since(self, sequence: int) -> bool:
+    """Returns whether reads since `sequence` was read are consistent."""
+    return not sequence & 1 and self.sequence == sequence
+
+  def __len__(self) -> int:
+    return self._size
+
+  def clear(self, destinations: _Destinations | None = None):
+    self._size = 0
+    if destinations is not None:
+      self._destinations = destinations
+
+  def begin_merge(self):
+    """Starts merging a response's departures into the table, in order."""
+    self._cursor = 0
+    self.changes = 0
+
+  def can_merge(self) -> bool:
+    return self._cursor < _MAX_DEPARTURES
+
+  def merge(
       self,
-      destination: str,
+      service: int,
+      destination: int,
       departure_time: int,
       actual_departure_time: int,
       cancelled: bool,
       fast_train: bool,
-  ):
-    self._destination = destination
-    self._departure_time = departure_time
-    self._actual_departure_time = actual_departure_time
-    self._cancelled = cancelled
-    self._fast_train = fast_train
-
-  @property
-  def destination(self) -> str:
-    return self._destination
-
-  @property
-  def departure_time(self) -> int:
-    return self._departure_time
-
-  @property
-  def actual_departure_time(self) -> int:
-    return self._actual_departure_time
-
-  @property
-  def cancelled(self) -> bool:
-    return self._cancelled
-
-  @property
-  def fast_train(self) -> bool:
-    return self._fast_train
-
-  def __repr__(self) -> str:
-    return (
-        'Departure(destination="{}", departure_time={},'
-        'actual_departure_tume={}, cancelled={}, fast={})'
-    ).format(
-        self.destination,
-        self.departure_time,
-        self.actual_departure_time,
-        self.cancelled,
-        self.fast_train,
-    )
+      departure_epoch: int = 0,
+  ) -> bool:
+    """Adds or updates the departure for `service`.
+
+    Departures keep the order they're merged in, so an existing departure is
+    moved up to the current position if needed. Returns False if the table is
+    already full.
+    """
+    cursor = self._cursor
+    if cursor == _MAX_DEPARTURES:
+      return False
+    flags = destination << _DESTINATION_SHIFT
+    if cancelled:
+      flags |= _CANCELLED
+    if fast_train:
+      flags |= _FAST_TRAIN
+
+    # Services without a serviceUid can't be matched, so are always added.
+    index = self.find(service, cursor) if service else -1
+    if index < 0:
+      # Make room, dropping the last departure if full. It'll be added back
+      # if it's merged later.
+      if self._size < _MAX_DEPARTURES:
+        self._size += 1
+      self._move_rows(cursor + 1, cursor, self._size - cursor - 1)
+      self.changes += 1
+    elif index != cursor:
+      self._swap_rows(cursor, index)
+      self.changes += 1
+
+    offset = cursor * _RECORD_SIZE
+    records = self._records
+    if index < 0 or (
+        records[offset + _DEPARTURE_TIME] != departure_time
+        or records[offset + _ACTUAL_DEPARTURE_TIME] != actual_departure_time
+        or records[offset + _FLAGS] != flags
+        or self.departure_epoch(cursor) != departure_epoch
+    ):
+      if index >= 0:
+        self.changes += 1
+      records[offset + _DEPARTURE_TIME] = departure_time
+      records[offset + _ACTUAL_DEPARTURE_TIME] = actual_departure_time
+      records[offset + _FLAGS] = flags
+      records[offset + _SERVICE_HIGH] = service >> 16
+      records[offset + _SERVICE_LOW] = service & 0xFFFF
+      records[offset + _EPOCH_HIGH] = departure_epoch >> 16
+      records[offset + _EPOCH_LOW] = departure_epoch & 0xFFFF
+    self._cursor = cursor + 1
+    return True
+
+  def end_merge(self):
+    """Removes departures that weren't in the merged response.
+
+    Only call this once a complete response has been merged. A partial
+    response leaves departures that it didn't get to in place.
+    """
+    if self._size > self._cursor:
+      self.changes += self._size - self._cursor
+      self._size = self._cursor
+
+  def abort_merge(self, now_minutes: int):
+    """Ends a merge that didn't complete, putting departures back in order.
+
+    Departures merged so far were moved ahead of those the merge didn't get
+    to, so sort them back into order of when they're booked to depart, in
+    minutes from `now_minutes`.
+    """
+    for i in range(1, self._size):
+      minutes = _minutes_from(self.departure_time(i), now_minutes)
+      j = i
+      while (
+          j > 0
+          and _minutes_from(self.departure_time(j - 1), now_minutes) > minutes
+      ):
+        self._swap_rows(j - 1, j)
+        j -= 1
+    self._cursor = self._size
+
+  def _move_rows(self, dst: int, src: int, count: int):
+    records = self._records
+    dst *= _RECORD_SIZE
+    src *= _RECORD_SIZE
+    count *= _RECORD_SIZE
+    if dst > src:
+      for i in range(count - 1, -1, -1):
+        records[dst + i] = records[src + i]
+    else:
+      for i in range(count):
+        records[dst + i] = records[src + i]
+
+  def _swap_rows(self, a: int, b: int):
+    records = self._records
+    a *= _RECORD_SIZE
+    b *= _RECORD_SIZE
+    for i in range(_RECORD_SIZE):
+      records[a + i], records[b + i] = records[b + i], records[a + i]
+
+  def append_from(self, other: 'DepartureTable', index: int) -> bool:
+    """Copies `other`'s departure at `index`, returning False if full."""
+    if self._size == _MAX_DEPARTURES:
+      return False
+    offset = self._size * _RECORD_SIZE
+    other_offset = index * _RECORD_SIZE
+    records, other_records = self._records, other._records
+    for i in range(_RECORD_SIZE):
+      records[offset + i] = other_records[other_offset + i]
+    if other._destinations is not self._destinations:
+      destination = self._destinations.intern(other.destination(index))
+      records[offset + _FLAGS] = (
+          records[offset + _FLAGS] & (_CANCELLED | _FAST_TRAIN)
+      ) | (destination << _DESTINATION_SHIFT)
+    self._size += 1
+    return True
+
+  def service(self, index: int) -> int:
+    """Returns key identifying the service, from its serviceUid and runDate."""
+    offset = index * _RECORD_SIZE
+    records = self._records
+    high, low = records[offset + _SERVICE_HIGH], records[offset + _SERVICE_LOW]
+    return high << 16 | low
+
+  def departure_epoch(self, index: int) -> int:
+    """Returns seconds since the epoch it's expected to depart, or 0."""
+    offset = index * _RECORD_SIZE
+    records = self._records
+    high, low = records[offset + _EPOCH_HIGH], records[offset + _EPOCH_LOW]
+    return high << 16 | low
+
+  def find(self, service: int, start: int = 0) -> int:
+    """Returns index of departure for `service`, or -1 if there isn't one."""
+    for i in range(start, self._size):
+      if self.service(i) == service:
+        return i
+    return -1
+
+  def link(self, previous: 'DepartureTable'):
+    """Records where each departure's service was in `previous`."""
+    for i in range(self._size):
+      service = self.service(i)
+      index = previous.find(service) if service else -1
+      self._previous_rows[i] = index if index >= 0 else 0xFF
+
+  def previous_index(self, index: int) -> int:
+    """Returns row of the departure in the previous generation, or -1 if new.
+
+    Rows are matched by service, so this stays stable when only a departure's
+    times or status change, and tracks departures moving up the board.
+    """
+    previous_index = self._previous_rows[index]
+    return -1 if previous_index == 0xFF else previous_index
+
+  def is_full(self) -> bool:
+    return self._size == _MAX_DEPARTURES
+
+  def destinations(self) -> _Destinations:
+    return self._destinations
+
+  def destination(self, index: int) -> str:
+    flags = self._records[index * _RECORD_SIZE + _FLAGS]
+    return self._destinations.name(flags >> _DESTINATION_SHIFT)
+
+  def departure_time(self, index: int) -> int:
+    return self._records[index * _RECORD_SIZE + _DEPARTURE_TIME]
+
+  def actual_departure_time(self, index: int) -> int:
+    return self._records[index * _RECORD_SIZE + _ACTUAL_DEPARTURE_TIME]
+
+  def cancelled(self, index: int) -> bool:
+    return bool(self._records[index * _RECORD_SIZE + _FLAGS] & _CANCELLED)
+
+  def fast_train(self, index: int) -> bool:
+    return bool(self._records[index * _RECORD_SIZE + _FLAGS] & _FAST_TRAIN)
+
+  def diff(self, other: 'DepartureTable') -> int:
+    """Returns bitmask of rows that differ from `other`'s."""
+    changed_rows = 0
+    records, other_records = self._records, other._records
+    for i in range(max(self._size, other._size)):
+      offset = i * _RECORD_SIZE
+      if (
+          i >= self._size
+          or i >= other._size
+          or records[offset + _DEPARTURE_TIME]
+          != other_records[offset + _DEPARTURE_TIME]
+          or records[offset + _ACTUAL_DEPARTURE_TIME]
+          != other_records[offset + _ACTUAL_DEPARTURE_TIME]
+          or (records[offset + _FLAGS] ^ other_records[offset + _FLAGS])
+          & (_CANCELLED | _FAST_TRAIN)
+          or self.destination(i) != other.destination(i)
+      ):
+        changed_rows |= 1 << i
+    return changed_rows
 
   def __eq__(self, other: object) -> bool:
     return (
-        isinstance(other, Departure)
-        and self.departure_time == other.departure_time
-        and self.actual_departure_time == other.actual_departure_time
-        and self.cancelled == other.cancelled
-        and self.destination == other.destination
-        and self.fast_train == other.fast_train
+        isinstance(other, DepartureTable)
+        and self.name == other.name
+        and not self.diff(other)
     )
 
+  def dump(self, saved: int) -> bytes:
+    """Returns compact binary form of the table, for `load()`.
+
+    `saved` is stored alongside, e.g. the time the table was saved.
+    """
+    names = [self.name]
+    departures = []
+    for i in range(self._size):
+      destination = self.destination(i)
+      if destination not in names:
+        names.append(destination)
+      flags = (1 if self.cancelled(i) else 0) | (2 if self.fast_train(i) else 0)
+      departures.append(
+          struct.pack(
+              _DUMP_DEPARTURE,
+              self.departure_time(i),
+              self.actual_departure_time(i),
+              flags,
+              names.index(destination),
+              self.service(i),
+              self.departure_epoch(i),
+          )
+      )
+
+    data = [
+        struct.pack(
+            _DUMP_HEADER, _DUMP_MAGIC, saved, len(departures), len(names)
+        )
+    ]
+    for name in names:
+      encoded = name.encode()
+      data.append(bytes((len(encoded),)))
+      data.append(encoded)
+    return b''.join(data) + b''.join(departures)
+
+  def load(self, data: bytes) -> int:
+    """Merges departures from `dump()`'s binary form, returning `saved`."""
+    magic, saved, num_departures, num_names = struct.unpack_from(
+        _DUMP_HEADER, data
+    )
+    if magic != _DUMP_MAGIC:
+      raise ValueError('Unrecognised departures dump!')
+    offset = struct.calcsize(_DUMP_HEADER)
+    names = []
+    for _ in range(num_names):
+      length = data[offset]
+      names.append(str(data[offset + 1 : offset + 1 + length], 'utf-8'))
+      offset += 1 + length
+
+    self.begin_merge()
+    size = struct.calcsize(_DUMP_DEPARTURE)
+    for _ in range(num_departures):
+      (
+          departure_time,
+          actual_departure_time,
+          flags,
+          destination,
+          service,
+          departure_epoch,
+      ) = struct.unpack_from(_DUMP_DEPARTURE, data, offset)
+      offset += size
+      self.merge(
+          service,
+          self._destinations.intern(names[destination]),
+          departure_time,
+          actual_departure_time,
+          bool(flags & 1),
+          bool(flags & 2),
+          departure_epoch,
+      )
+    self.end_merge()
+    self.name = names[0]
+    return saved
 
-Station = collections.namedtuple('Station', ('name', 'departures'))
+  def __repr__(self) -> str:
+    return 'DepartureTable(name="{}", departures={}, generation={})'.format(
+        self.name, len(self), self.generation
+    )
 
 
-def get_departures(
+async def get_departures(
     station: str,
     destination: str,
     basic_auth: str,
@@ -288,72 +1450,706 @@ def get_departures(
     min_departure_time: int = 0,
     buffer: memoryview | None = None,
     ssl_context: ssl.SSLContext | None = None,
+    connection: _Connection | None = None,
     slow_stations: set[str] | None = None,
-) -> Station:
-  """Requests set of departures from->to provided stations."""
-  url = endpoint + '/search/{station}/to/{destination}'.format(
-      station=station,
-      destination=destination,
-  )
-  response = _http_request(
-      url,
+    validators: dict[str, str] | None = None,
+    previous: DepartureTable | None = None,
+    table: DepartureTable | None = None,
+    binary: bool = False,
+    limit: int = 0,
+    proxy: bool = False,
+) -> DepartureTable:
+  """Requests set of departures from->to provided stations.
+
+  Departures are merged into `table`, or a new table if not provided.
+
+  If `validators` is provided, it's used to remember the ETag/Last-Modified
+  headers of the response. Iff `previous` is also provided, they're sent as a
+  conditional request, returning `previous` if the departures haven't changed.
+
+  If `binary` is set, departures are requested in the proxy's compact binary
+  board format rather than as JSON, see `_parse_board()`. If `limit` is set,
+  the proxy only returns that many departures. Set `proxy` if `endpoint` is
+  the proxy in server/, see `get_route_departures()`.
+  """
+  owns_connection = connection is None
+  if owns_connection:
+    connection = _Connection(ssl_context)
+  try:
+    tables = await get_route_departures(
+        ((station, destination),),
+        basic_auth,
+        endpoint,
+        min_departure_time=min_departure_time,
+        buffer=buffer,
+        connection=connection,
+        slow_stations=slow_stations,
+        validators=(validators,),
+        previous=(previous,),
+        tables=(table if table is not None else DepartureTable(station),),
+        binary=binary,
+        limit=limit,
+        proxy=proxy,
+    )
+  finally:
+    if owns_connection:
+      connection.close()
+  return tables[0]
+
+
+async def get_route_departures(
+    routes,
+    basic_auth: str,
+    endpoint: str,
+    *,
+    min_departure_time: int = 0,
+    buffer: memoryview | None = None,
+    connection: _Connection,
+    slow_stations: set[str] | None = None,
+    validators=None,
+    previous=None,
+    tables,
+    binary: bool = False,
+    limit: int = 0,
+    batch: bool = False,
+    proxy: bool = False,
+) -> list[DepartureTable]:
+  """Requests departures for several (station, destination) routes at once.
+
+  The requests are pipelined on `connection`, sharing `buffer`, so fetching
+  several routes takes little longer than fetching one. Each route's
+  departures are merged into its entry in `tables`.
+
+  `validators` and `previous` optionally have an entry for each route, see
+  `get_departures()`. Returns each route's table, which is its `previous`
+  table if the route's departures haven't changed.
+
+  If `batch` is set, every route is requested from the proxy in a single
+  request, which it answers by searching for them all concurrently. Only the
+  first entry of `validators` is then used, for the whole batch.
+
+  `slow_stations`, `limit` and `min_departure_time` are only passed on to
+  the endpoint if `proxy` is set, otherwise departures are filtered here.
+  """
+  urls = []
+  headers = []
+  consumers = []
+  # Query parameters for the proxy in server/, which RTT doesn't take.
+  params = []
+  if proxy and slow_stations:
+    # The proxy works out which services are fast, see _parse_service().
+    params.append('slow_stations=' + ','.join(sorted(slow_stations)))
+  if proxy and limit > 0:
+    # Saves the proxy looking up services that wouldn't be shown.
+    params.append('limit={}'.format(limit))
+  if proxy and min_departure_time > 0:
+    # So services too soon to show don't use up the limit.
+    params.append('min_departure_time={}'.format(min_departure_time))
+  if batch:
+    params.append(
+        'routes=' + ','.join('{}-{}'.format(s, d) for s, d in routes)
+    )
+  query = '?' + '&'.join(params) if params else ''
+
+  if batch:
+    urls.append(
+        endpoint + ('/batch/board' if binary else '/batch') + query
+    )
+    has_previous = previous and all(p is not None for p in previous)
+    headers.append(
+        _conditional_headers(validators[0])
+        if validators and has_previous
+        else None
+    )
+    consumers.append(_batch_consumer(tables, min_departure_time, binary))
+  else:
+    for i in range(len(routes)):
+      station, destination = routes[i]
+      urls.append(
+          endpoint
+          + '/{path}/{station}/to/{destination}{query}'.format(
+              path='board' if binary else 'search',
+              station=station,
+              destination=destination,
+              query=query,
+          )
+      )
+      headers.append(
+          _conditional_headers(validators[i])
+          if validators and previous and previous[i] is not None
+          else None
+      )
+      consumers.append(
+          _departures_consumer(tables[i], min_departure_time, binary)
+      )
+
+  if buffer is None:
+    buffer = memoryview(bytearray(_STREAM_BUFFER_SIZE))
+
+  responses = await _http_pipeline(
+      urls,
       basic_auth=basic_auth,
+      headers=headers,
       timeout=_REQUEST_TIMEOUT,
       buffer=buffer,
-      ssl_context=ssl_context,
+      connection=connection,
+      consumers=consumers,
   )
-  if response.status_code != 200:
-    raise ValueError('Error getting departure! {}'.format(response.status_code))
-
-  # TODO: JSON decoding allocates a lot of small objects, which can put pressure
-  # on memory fragmentation. Might be worth writing custom parsing of content.
-  response_json = json.loads(response.content)
-  services = response_json['services']
-  services = [] if services is None else services
-
-  departures = []
-  for service in services:
-    location = service['locationDetail']
-
-    # Iff the service is cancelled, service['destination'] is populated. 
-    # Otherwise use location['destination'].
-    destinations = service.get('destination', location['destination'])
-    # We could have multiple destinations, so concatentate them together.
-    destination = ','.join([d['description'] for d in destinations])
-    departure_time = int(location['gbttBookedDeparture'])
-    realtime_departure = int(location.get('realtimeDeparture', departure_time))
-    cancelled = location.get('cancelReasonCode') is not None
-
-    if min_departure_time > 0:
-      full_departure_datetime = _calculate_departure_datetime(service)
-      now = time.mktime(utils.get_uk_time())
-      if now + (min_departure_time * 60) > full_departure_datetime:
+
+  results = []
+  for i in range(len(responses)):
+    response = responses[i]
+    if response.status_code == 304 and headers[i] is not None:
+      content = previous if batch else previous[i]
+    elif response.status_code != 200:
+      raise ValueError(
+          'Error getting departure! {}'.format(response.status_code)
+      )
+    else:
+      content = response.content
+    if batch:
+      results.extend(content)
+    else:
+      results.append(content)
+
+  # Only remember validators once every response has been successfully
+  # parsed, otherwise we'd keep getting 304s for responses we never used.
+  if validators:
+    for i in range(len(responses)):
+      route_validators = validators[i]
+      if route_validators is None or responses[i].status_code != 200:
         continue
+      route_validators.clear()
+      for name in ('etag', 'last-modified'):
+        value = responses[i].headers.get(name)
+        if value is not None:
+          route_validators[name] = value
+
+  gc.collect()
+  return results
+
 
-    fast_train = False
-    calling_stations = set(service.get('callingAt', None))
-    if slow_stations and calling_stations:
-      if len(calling_stations.intersection(slow_stations)) == 0:
-        fast_train = True
-
-    departures.append(
-        Departure(
-            destination,
-            departure_time,
-            realtime_departure,
-            cancelled,
-            fast_train,
+def _conditional_headers(validators) -> dict[str, str] | None:
+  """Returns headers to only get a response if it's changed since last time."""
+  if not validators:
+    return None
+  headers = {}
+  if 'etag' in validators:
+    headers['If-None-Match'] = validators['etag']
+  if 'last-modified' in validators:
+    headers['If-Modified-Since'] = validators['last-modified']
+  return headers
+
+
+def _batch_consumer(tables, min_departure_time: int, binary: bool = False):
+  async def parse(stream, buffer: memoryview):
+    return await _parse_batch(
+        buffer,
+        tables,
+        stream=stream,
+        min_departure_time=min_departure_time,
+        binary=binary,
+    )
+
+  return parse
+
+
+def _departures_consumer(
+    table: DepartureTable,
+    min_departure_time: int,
+    binary: bool = False,
+):
+  async def parse(stream, buffer: memoryview) -> DepartureTable:
+    if binary:
+      return await _parse_board(
+          buffer,
+          table,
+          stream=stream,
+          min_departure_time=min_departure_time,
+      )
+    return await _parse_departures(
+        buffer,
+        table,
+        stream=stream,
+        min_departure_time=min_departure_time,
+    )
+
+  return parse
+
+
+def _parse_descriptions(
+    reader: _JsonReader, destinations: _Destinations
+) -> int:
+  """Parses list of locations, returning index of their joined descriptions."""
+  index = -1
+  descriptions = None
+  reader.begin_array()
+  while reader.next_item():
+    reader.begin_object()
+    while reader.next_key():
+      if not reader.key_is(b'description'):
+        reader.skip()
+      elif index < 0 and descriptions is None:
+        index = destinations.read(reader)
+      else:
+        # Services with several destinations are rare, so it's fine for them
+        # to allocate.
+        if descriptions is None:
+          descriptions = [destinations.name(index)]
+        descriptions.append(reader.string())
+  if descriptions is not None:
+    return destinations.intern(','.join(descriptions))
+  return index
+
+
+def _service_key(uid_hash: int, run_date: tuple[int, int, int]) -> int:
+  """Combines hash of serviceUid and its runDate into a 30-bit key."""
+  yyyy, month, dd = run_date
+  return (uid_hash * 31 + (yyyy * 12 + month) * 31 + dd) & 0x3FFFFFFF
+
+
+def _parse_origin_time(reader: _JsonReader) -> int:
+  """Parses list of origins, returning the first origin's public time."""
+  origin_time = -1
+  reader.begin_array()
+  while reader.next_item():
+    reader.begin_object()
+    while reader.next_key():
+      if origin_time < 0 and reader.key_is(b'publicTime'):
+        origin_time = reader.integer()
+      else:
+        reader.skip()
+  return origin_time
+
+
+def _parse_service(
+    reader: _JsonReader,
+    table: DepartureTable,
+    earliest_departure: int,
+):
+  """Parses a single RTT service, merging it into `table` unless skipped.
+
+  Whether it's a fast train comes from the "fast" flag added by the proxy,
+  when given slow stations. Otherwise it's never a fast train.
+  """
+  location_destination = service_destination = -1
+  departure_time = realtime_departure = origin_time = -1
+  cancelled = False
+  run_date = None
+  service = 0
+  fast_train = False
+
+  reader.begin_object()
+  while reader.next_key():
+    if reader.key_is(b'locationDetail'):
+      reader.begin_object()
+      while reader.next_key():
+        if reader.key_is(b'gbttBookedDeparture'):
+          departure_time = reader.integer()
+        elif reader.key_is(b'realtimeDeparture'):
+          realtime_departure = reader.integer()
+        elif reader.key_is(b'cancelReasonCode'):
+          if not reader.null():
+            cancelled = True
+            reader.skip()
+        elif reader.key_is(b'destination'):
+          location_destination = _parse_descriptions(
+              reader, table.destinations()
+          )
+        elif reader.key_is(b'origin'):
+          origin_time = _parse_origin_time(reader)
+        else:
+          reader.skip()
+    elif reader.key_is(b'destination'):
+      # Iff the service is cancelled, service['destination'] is populated.
+      # Otherwise use location['destination'].
+      if not reader.null():
+        service_destination = _parse_descriptions(
+            reader, table.destinations()
         )
+    elif reader.key_is(b'runDate'):
+      run_date = reader.date()
+    elif reader.key_is(b'serviceUid'):
+      service = reader.string_hash()
+    elif reader.key_is(b'fast'):
+      fast_train = reader.boolean()
+    else:
+      reader.skip()
+
+  if departure_time < 0:
+    raise ValueError('Service missing gbttBookedDeparture!')
+  if realtime_departure < 0:
+    realtime_departure = departure_time
+
+  destination = (
+      service_destination if service_destination >= 0 else location_destination
+  )
+  if destination < 0:
+    raise ValueError('Service missing destination!')
+
+  _merge_service(
+      table,
+      earliest_departure,
+      service,
+      run_date,
+      destination,
+      departure_time,
+      realtime_departure,
+      origin_time,
+      cancelled,
+      fast_train,
+  )
+
+
+def _merge_service(
+    table: DepartureTable,
+    earliest_departure: int,
+    service: int,
+    run_date: tuple[int, int, int] | None,
+    destination: int,
+    departure_time: int,
+    realtime_departure: int,
+    origin_time: int,
+    cancelled: bool,
+    fast_train: bool,
+):
+  """Merges a parsed service into `table`, unless it leaves too soon.
+
+  `service` is the hash of its serviceUid, or 0 if it doesn't have one, and
+  `origin_time` is -1 if unknown.
+  """
+  # Remember when the service is expected to depart, so that it can be dropped
+  # from the board once it has without needing to fetch departures again.
+  departure_epoch = 0
+  if run_date is not None and origin_time >= 0:
+    departure_epoch = _calculate_departure_datetime(
+        run_date, realtime_departure, origin_time
     )
 
-  results = Station(response_json['location']['name'], departures)
-  del response_json
-  gc.collect()  # Explicitly delete and GC JSON objects.
-  return results
+  if earliest_departure > 0:
+    if run_date is None or origin_time < 0:
+      raise ValueError('Service missing runDate or origin!')
+    full_departure_datetime = _calculate_departure_datetime(
+        run_date,
+        realtime_departure if cancelled else departure_time,
+        origin_time,
+    )
+    if earliest_departure > full_departure_datetime:
+      return
+
+  # Services without a serviceUid can't be matched, so are left with key 0.
+  if service and run_date is not None:
+    service = _service_key(service, run_date)
+  table.merge(
+      service,
+      destination,
+      departure_time,
+      realtime_departure,
+      cancelled,
+      fast_train,
+      departure_epoch,
+  )
+
+
+async def _parse_departures(
+    content: memoryview,
+    table: DepartureTable,
+    *,
+    stream=None,
+    min_departure_time: int = 0,
+) -> DepartureTable:
+  """Merges RTT search response into `table`.
+
+  Departures are matched to those already in the table by service, so rows
+  for services that haven't changed are left untouched, see
+  `DepartureTable.merge()`.
+
+  This walks the response in-place rather than using json.loads(), which
+  allocates many small objects that fragment the heap. Only the fields needed
+  for each departure are decoded, everything else is skipped over. Only the
+  first departures that fit in the table are kept.
+
+  If `stream` is provided, the response is read from it as it's parsed, using
+  `content` as the buffer.
+  """
+  reader = _JsonReader(content, stream)
+  await _read_departures(
+      reader, table, _earliest_departure(min_departure_time)
+  )
+  return table
+
+
+async def _read_departures(
+    reader: _JsonReader, table: DepartureTable, earliest_departure: int
+):
+  """Merges the RTT search response object next in `reader` into `table`."""
+  table.begin_merge()
+  name = -1
+  await reader.fill()
+  reader.begin_object()
+  while await reader.fetch_key():
+    if reader.key_is(b'location'):
+      await reader.fetch_value()
+      reader.begin_object()
+      while reader.next_key():
+        if reader.key_is(b'name'):
+          name = table.destinations().read(reader)
+        else:
+          reader.skip()
+    elif reader.key_is(b'services'):
+      if await reader.fetch_array():
+        while await reader.fetch_item():
+          if not table.can_merge():
+            reader.skip()
+          else:
+            _parse_service(reader, table, earliest_departure)
+    else:
+      await reader.fetch_value()
+      reader.skip()
+
+  if name < 0:
+    raise ValueError('Response missing location name!')
+  table.name = table.destinations().name(name)
+  table.end_merge()
+
+
+def _earliest_departure(min_departure_time: int) -> int:
+  """Returns earliest departure datetime to show, or 0 to show all."""
+  if min_departure_time <= 0:
+    return 0
+  return time.mktime(utils.get_uk_time()) + min_departure_time * 60
+
+
+# Binary board format served by the proxy, see server._encode_board(). The
+# header is the magic, number of services and length of the station name,
+# followed by the name. Each service is a fixed-size little-endian record of
+# booked, realtime and origin [h]h[m]m times, run date (year, month, day),
+# flags, and the lengths of the serviceUid and destination that follow it.
+_BOARD_MAGIC = b'PTB1'
+_BOARD_HEADER_SIZE = micropython.const(6)
+_BOARD_SERVICE_SIZE = micropython.const(13)
+_BOARD_CANCELLED = micropython.const(1)
+_BOARD_FAST_TRAIN = micropython.const(2)
+_BOARD_NO_TIME = micropython.const(0xFFFF)
+
+
+class _BoardReader:
+  """Reads little-endian fields of a binary board in-place from a buffer.
+
+  Like `_JsonReader`, if a stream is provided the buffer is used as a sliding
+  window over it, so only a single record needs to fit in the buffer.
+  """
+
+  def __init__(self, buf: memoryview, stream=None):
+    self.buf = buf
+    self._stream = stream
+    self._end = len(buf) if stream is None else 0
+    self._pos = 0
+
+  async def fetch(self, n: int):
+    """Makes sure the next `n` bytes are buffered."""
+    while self._end - self._pos < n:
+      keep = self._end - self._pos
+      if self._stream is None or n > len(self.buf):
+        raise ValueError('Unexpected end of board')
+      _move(self.buf, 0, self._pos, keep)
+      self._pos = 0
+      self._end = keep
+      read = await self._stream.readinto(self.buf[keep:])
+      if not read:
+        raise ValueError('Unexpected end of board')
+      self._end += read
+
+  def uint8(self) -> int:
+    value = self.buf[self._pos]
+    self._pos += 1
+    return value
+
+  def uint16(self) -> int:
+    value = self.buf[self._pos] | self.buf[self._pos + 1] << 8
+    self._pos += 2
+    return value
+
+  def skip(self, n: int) -> int:
+    """Skips over the next `n` bytes, returning where they start."""
+    start = self._pos
+    self._pos += n
+    return start
+
+
+async def _parse_board(
+    content: memoryview,
+    table: DepartureTable,
+    *,
+    stream=None,
+    min_departure_time: int = 0,
+) -> DepartureTable:
+  """Merges binary board from the proxy into `table`.
+
+  Same as `_parse_departures()`, but the board's fixed-size records are read
+  directly, with the proxy having already worked out which are fast trains.
+  """
+  reader = _BoardReader(content, stream)
+  await _read_board(reader, table, _earliest_departure(min_departure_time))
+  return table
+
+
+async def _read_board(
+    reader: _BoardReader, table: DepartureTable, earliest_departure: int
+):
+  """Merges the binary board next in `reader` into `table`."""
+  destinations = table.destinations()
+  table.begin_merge()
+  await reader.fetch(_BOARD_HEADER_SIZE)
+  if not _equals(reader.buf, reader.skip(4), _BOARD_MAGIC, 4):
+    raise ValueError('Unrecognised board format!')
+  num_services = reader.uint8()
+  length = reader.uint8()
+  await reader.fetch(length)
+  start = reader.skip(length)
+  table.name = destinations.name(
+      destinations.read_bytes(reader.buf, start, start + length)
+  )
+
+  for _ in range(num_services):
+    await reader.fetch(_BOARD_SERVICE_SIZE)
+    departure_time = reader.uint16()
+    realtime_departure = reader.uint16()
+    origin_time = reader.uint16()
+    yyyy = reader.uint16()
+    month = reader.uint8()
+    dd = reader.uint8()
+    flags = reader.uint8()
+    uid_length = reader.uint8()
+    length = reader.uint8()
+    await reader.fetch(uid_length + length)
+    uid = reader.skip(uid_length)
+    start = reader.skip(length)
+    if not table.can_merge():
+      continue
+
+    _merge_service(
+        table,
+        earliest_departure,
+        _hash(reader.buf, uid, uid + uid_length) if uid_length else 0,
+        (yyyy, month, dd) if yyyy else None,
+        destinations.read_bytes(reader.buf, start, start + length),
+        departure_time,
+        realtime_departure,
+        -1 if origin_time == _BOARD_NO_TIME else origin_time,
+        bool(flags & _BOARD_CANCELLED),
+        bool(flags & _BOARD_FAST_TRAIN),
+    )
+
+  table.end_merge()
+
+
+async def _parse_batch(
+    content: memoryview,
+    tables,
+    *,
+    stream=None,
+    min_departure_time: int = 0,
+    binary: bool = False,
+):
+  """Merges each board of a batch response from the proxy into `tables`.
+
+  Binary batches are just each board one after another. Otherwise they're
+  a JSON object, with a "boards" array of RTT search responses.
+  """
+  earliest_departure = _earliest_departure(min_departure_time)
+  if binary:
+    reader = _BoardReader(content, stream)
+    for table in tables:
+      await _read_board(reader, table, earliest_departure)
+    return tables
+
+  boards = 0
+  reader = _JsonReader(content, stream)
+  await reader.fill()
+  reader.begin_object()
+  while await reader.fetch_key():
+    if reader.key_is(b'boards'):
+      if await reader.fetch_array():
+        while await reader.begin_item():
+          if boards == len(tables):
+            raise ValueError('Batch has too many boards!')
+          await _read_departures(reader, tables[boards], earliest_departure)
+          boards += 1
+    else:
+      await reader.fetch_value()
+      reader.skip()
+  if boards != len(tables):
+    raise ValueError('Batch missing boards!')
+  return tables
+
+
+def _minutes_from(hh_mm: int, now_minutes: int) -> int:
+  """Returns minutes from `now_minutes` past midnight until [h]h[m]m time.
+
+  Times more than 12 hours ahead are assumed to have already passed.
+  """
+  hh, mm = divmod(hh_mm, 100)
+  minutes = (hh * 60 + mm - now_minutes) % (24 * 60)
+  return minutes - 24 * 60 if minutes >= 12 * 60 else minutes
+
+
+def _merge_departures(
+    routes,
+    table: DepartureTable,
+    positions: bytearray,
+    min_departure_time: int = 0,
+):
+  """Merges each route's departures into `table` in time order.
+
+  Each route's departures are already in time order, so this repeatedly takes
+  the earliest of the routes' next departures. Services that run on more than
+  one route are only added once. `positions` is scratch space, with an entry
+  for each route.
+
+  Departures that have already left, or leave within `min_departure_time`
+  minutes, are dropped.
+  """
+  now = utils.get_uk_time()
+  now_minutes = now[3] * 60 + now[4]
+  earliest_departure = time.mktime(now) + min_departure_time * 60
+  table.name = routes[0].name
+  for r in range(len(routes)):
+    positions[r] = 0
+
+  while not table.is_full():
+    best = -1
+    best_minutes = 0
+    for r in range(len(routes)):
+      route = routes[r]
+      if positions[r] < len(route):
+        minutes = _minutes_from(route.departure_time(positions[r]), now_minutes)
+        if best < 0 or minutes < best_minutes:
+          best, best_minutes = r, minutes
+    if best < 0:
+      break
+
+    route = routes[best]
+    i = positions[best]
+    positions[best] = i + 1
+    if 0 < route.departure_epoch(i) < earliest_departure:
+      continue
+    service = route.service(i)
+    # Services without a serviceUid can't be matched, so are always added.
+    if not service or table.find(service) < 0:
+      table.append_from(route, i)
 
 
 class DepartureUpdater:
-  """Class that updates departures for a given station periodically."""
+  """Class that updates departures for a given station periodically.
+
+  Departures for any additional `routes`, each a (station, destination) pair,
+  are fetched alongside and merged onto the same board. If `binary` is set,
+  they're fetched in the proxy's binary board format. If `limit` is set, only
+  that many departures are fetched for each route. If `batch` is set, every
+  route is fetched from the proxy in a single request. All of these need
+  `proxy` to be set, meaning the endpoint is the proxy in server/.
+  """
 
   def __init__(
       self,
@@ -364,40 +2160,199 @@ class DepartureUpdater:
       min_departure_time: int,
       *,
       slow_stations: set[str] | None = None,
+      routes: tuple[tuple[str, str], ...] | None = None,
+      binary: bool = False,
+      limit: int = 0,
+      batch: bool = False,
+      proxy: bool = False,
   ):
-    self._station = station
-    self._destination = destination
+    self._routes = ((station, destination),)
+    if routes:
+      self._routes += tuple(routes)
     self._endpoint = endpoint
     self._auth = auth
     self._min_departure_time = min_departure_time
     self._slow_stations = slow_stations
-
-    self._lock = _thread.allocate_lock()
-    self._departures = Station(station, tuple())
-    self._buffer = bytearray(_MAXRESPONSE_SIZE)
+    self._binary = binary
+    self._limit = limit
+    self._batch = batch and len(self._routes) > 1
+    self._proxy = proxy
+
+    # Every table shares the same destination names, with room for each
+    # route's departures to bring in new ones.
+    self._destinations = self._make_destinations()
+
+    # Departures are merged into the back table, then published by swapping
+    # it with the front table. Only this thread writes either reference, and
+    # reference assignment is atomic, so the render thread never blocks.
+    self._departures = DepartureTable(station, self._destinations)
+    self._next_departures = DepartureTable(station, self._destinations)
+
+    # Departures for each route, which each response is merged into.
+    self._route_departures = [
+        DepartureTable(s, self._destinations) for s, _ in self._routes
+    ]
+    self._validators = [{} for _ in self._routes]
+    self._merge_positions = bytearray(len(self._routes))
+    # Whether route tables may be part way through being merged.
+    self._updating = False
+    # When restored departures were saved, until they've been fetched again.
+    self._stale_since = 0
+
+    self._buffer = bytearray(_STREAM_BUFFER_SIZE)
     self._memoryview = memoryview(self._buffer)
     self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-
-  def update(self):
-    """Updates the set of departures for a given station."""
-    departures = get_departures(
-        self._station,
-        self._destination,
-        self._auth,
-        self._endpoint,
-        slow_stations=self._slow_stations,
-        min_departure_time=self._min_departure_time,
-        buffer=self._memoryview,
-        ssl_context=self._ssl_context,
-    )
-    with self._lock:
-      self._departures = departures
-
-  def departures(self) -> tuple[Departure, ...]:
-    """Returns tuple of departures."""
-    with self._lock:
-      return self._departures.departures
+    self._connection = _Connection(self._ssl_context)
+
+  async def update(self) -> bool:
+    """Updates the set of departures for a given station.
+
+    Uses conditional requests, so that if a route's departures haven't
+    changed since the last update they're neither downloaded nor parsed
+    again. Returns whether the departures changed.
+    """
+    route_departures = self._route_departures
+    if self._destinations.nearly_full(len(self._routes)):
+      # Start again with fresh tables, and make sure they're fully refetched.
+      self._destinations = self._make_destinations()
+      for i in range(len(route_departures)):
+        route_departures[i].clear(self._destinations)
+        self._validators[i].clear()
+    for table in route_departures:
+      # Stays zero for routes whose departures haven't changed (304).
+      table.changes = 0
+
+    self._updating = True
+    try:
+      await get_route_departures(
+          self._routes,
+          self._auth,
+          self._endpoint,
+          slow_stations=self._slow_stations,
+          min_departure_time=self._min_departure_time,
+          buffer=self._memoryview,
+          connection=self._connection,
+          validators=self._validators,
+          previous=route_departures,
+          tables=route_departures,
+          binary=self._binary,
+          limit=self._limit,
+          batch=self._batch,
+          proxy=self._proxy,
+      )
+    except BaseException:
+      # A response may have been partially merged, so put the departures
+      # back in order for expire() to publish, and make sure the next request
+      # fetches each route in full rather than getting a 304.
+      now = utils.get_uk_time()
+      for table in route_departures:
+        table.abort_merge(now[3] * 60 + now[4])
+      for validators in self._validators:
+        validators.clear()
+      raise
+    finally:
+      self._updating = False
+
+    changed = False
+    for table in route_departures:
+      if table.changes:
+        changed = True
+    if self._stale_since:
+      # Restored departures are live again, even if they haven't changed.
+      self._stale_since = 0
+      changed = True
+    if not changed:
+      return False
+    return self._publish()
+
+  def _make_destinations(self) -> _Destinations:
+    return _Destinations(_MAX_DESTINATIONS * len(self._routes))
+
+  def expire(self) -> bool:
+    """Drops departures that have left from the board, without fetching.
+
+    Each departure's expected departure time is worked out when it's parsed,
+    so the board moves on as trains leave even between updates, or if the
+    network is down. Returns whether the departures changed.
+
+    Does nothing while an update is in progress, as it'll publish them once
+    it's done.
+    """
+    if self._updating:
+      return False
+    return self._publish()
+
+  def restore(self, data: bytes) -> int:
+    """Restores departures saved with `DepartureTable.dump()`.
+
+    Lets the last board be shown as soon as the display starts, before the
+    network is up. They're published as stale until the next successful
+    update, see `DepartureTable.stale_since`. Returns the time that was saved
+    alongside them.
+    """
+    route_departures = self._route_departures[0]
+    saved = route_departures.load(data)
+    self._stale_since = saved
+    self._publish()
+    return saved
+
+  def clear(self) -> bool:
+    """Drops all departures from the board, e.g. restored ones too old to show.
+
+    Returns whether the departures changed.
+    """
+    for i in range(len(self._route_departures)):
+      self._route_departures[i].clear()
+      self._validators[i].clear()
+    self._stale_since = 0
+    return self._publish()
+
+  def _publish(self) -> bool:
+    """Merges routes' departures into the back table and publishes it."""
+    previous = self._departures
+    table = self._next_departures
+    table.begin_write()
+    try:
+      table.clear(self._destinations)
+      _merge_departures(
+          self._route_departures,
+          table,
+          self._merge_positions,
+          self._min_departure_time,
+      )
+      table.stale_since = self._stale_since
+      changed_rows = table.diff(previous)
+      if (
+          not changed_rows
+          and table.name == previous.name
+          and table.stale_since == previous.stale_since
+      ):
+        return False
+      table.link(previous)
+      table.generation = previous.generation + 1
+      table.changed_rows = changed_rows
+    finally:
+      table.end_write()
+
+    self._departures = table
+    self._next_departures = previous
+    return True
+
+  def close(self):
+    """Closes the persistent connection to the departures endpoint."""
+    self._connection.close()
+
+  def tls_stats(self) -> tuple[int, int]:
+    """Returns number of TLS handshakes and total ms spent doing them."""
+    return self._connection.handshakes, self._connection.handshake_ms
+
+  def departures(self) -> DepartureTable:
+    """Returns the latest table of departures.
+
+    The table is reused by a later update, so reads from another thread must
+    be checked against its `sequence`, see `DepartureTable`.
+    """
+    return self._departures
 
   def station(self) -> str:
-    with self._lock:
-      return self._departures.name
+    return self._departures.name
@@ -20,17 +20,29 @@
 
 import time
 
+# The clock starts in 2021 on power-on, so is only set once it's past this.
+_MIN_SET_YEAR = 2024
 
-def get_uk_time() -> tuple[int, ...]:
-  """Calculate UK time, taking into account daylight savings."""
-  year = time.localtime()[0]
+
+def is_time_set() -> bool:
+  """Returns whether the clock has been set, e.g. using NTP."""
+  return time.localtime()[0] >= _MIN_SET_YEAR
+
+
+def get_uk_time(now: int | None = None) -> tuple[int, ...]:
+  """Calculate UK time, taking into account daylight savings.
+
+  Defaults to the current time, otherwise `now` is seconds since the epoch.
+  """
+  if now is None:
+    now = time.time()
+  year = time.localtime(now)[0]
   bst_start = time.mktime(
       (year, 3, 31 - ((5 * year // 4 + 4) % 7), 1, 0, 0, 0, 0, 0)
   )
   bst_end = time.mktime(
       (year, 10, 31 - ((5 * year // 4 + 1) % 7), 1, 0, 0, 0, 0, 0)
   )
-  now = time.time()
   if now >= bst_start and now < bst_end:
     return time.localtime(now + 3600)
   else:
@@ -22,9 +22,11 @@ import display
 import fonts
 import glyphs
 import trains
+import utils
 
 
 _WELCOME_TO = 'Welcome to'
+_LAST_UPDATED = 'Last updated {:02d}:{:02d}'
 
 
 def _time_to_str(hh_mm: int) -> str:
@@ -33,6 +35,20 @@ def _time_to_str(hh_mm: int) -> str:
   return '{:0>2}:{:0>2}'.format(hh, mm)
 
 
+def num_departure_rows(
+    screen: display.Display,
+    bold_font: fonts.Font,
+    tall_font: fonts.Font,
+    default_font: fonts.Font,
+    render_seconds: bool = True,
+) -> int:
+  """Returns how many departures MainWidget has room for on `screen`."""
+  clock_height = ClockWidget(
+      screen, tall_font, bold_font, render_seconds
+  ).bounds()[1]
+  return (screen.height - clock_height) // (default_font.max_bounds()[1] + 2)
+
+
 class Widget:
   """Base class for all Widgets"""
 
@@ -99,6 +115,27 @@ class ClockWidget(Widget):
     self._last_update = current_update
     return True
 
+  def reset(self):
+    """Makes the next render redraw the clock, e.g. if it was drawn over."""
+    self._last_update = None
+
+
+class StaleWidget(Widget):
+  """Renders when departures were last updated, e.g. if restored on startup."""
+
+  def __init__(self, screen: display.Display, font: fonts.Font):
+    super().__init__(screen)
+    self._font = font
+
+  def render(self, stale_since: int, x: int, y: int, w: int, h: int):
+    updated = utils.get_uk_time(stale_since)
+    message = _LAST_UPDATED.format(updated[3], updated[4])
+    message_w, message_h = self._font.calculate_bounds(message)
+    self._font.render_text(
+        message, self._screen, x + (w - message_w) // 2, y + h - message_h
+    )
+    return True
+
 
 class OutOfHoursWidget(Widget):
 
@@ -179,8 +216,6 @@ class DepartureWidget(Widget):
           self._status_font.calculate_bounds('Cancelled')[0],
       )
 
-    self._last_departure = None
-
   def bounds(self) -> tuple[int, int]:
     max_height = max(
         self._font.max_bounds()[1], self._status_font.max_bounds()[1]
@@ -190,28 +225,38 @@ class DepartureWidget(Widget):
     return self._width, max_height
 
   def render(
-      self, departure: trains.Departure | None, x: int, y: int, w: int, h: int
+      self,
+      departures: trains.DepartureTable,
+      index: int,
+      x: int,
+      y: int,
+      w: int,
+      h: int,
   ) -> bool:
-    if self._last_departure == departure:
-      return False
+    """Renders `departures[index]`, or clears the row if there isn't one.
 
-    self._last_departure = departure
+    Callers only render rows that have changed, see `DepartureTable`.
+    """
     self._screen.fill_rect(x, y, w, self._font.max_bounds()[1], 0)
-
-    if departure is None:
+    if index >= len(departures):
       return True
 
-    departure_time = _time_to_str(departure.departure_time)
-    self._font.render_text(departure_time, self._screen, x, y)
+    destination = departures.destination(index)
+    departure_time = departures.departure_time(index)
+    actual_departure_time = departures.actual_departure_time(index)
+    cancelled = departures.cancelled(index)
+    fast_train = departures.fast_train(index)
+
+    self._font.render_text(_time_to_str(departure_time), self._screen, x, y)
 
     x += self._max_clock_width + 2
-    self._font.render_text(departure.destination, self._screen, x, y)
+    self._font.render_text(destination, self._screen, x, y)
 
-    if departure.cancelled:
+    if cancelled:
       status = 'Cancelled'
       status_w, _ = self._status_font.calculate_bounds(status)
-    elif departure.departure_time != departure.actual_departure_time:
-      status = 'Exp {}'.format(_time_to_str(departure.actual_departure_time))
+    elif departure_time != actual_departure_time:
+      status = 'Exp {}'.format(_time_to_str(actual_departure_time))
       status_w, _ = self._status_font.calculate_bounds(status)
     else:
       status = 'On time'
@@ -219,7 +264,7 @@ class DepartureWidget(Widget):
 
     self._status_font.render_text(status, self._screen, w - status_w, y)
 
-    if departure.fast_train and self._fast_train_icon:
+    if fast_train and self._fast_train_icon:
       self._fast_train_icon.render_glyph(
           self._screen, w - self._fast_train_offset - 2, y
       )
@@ -249,12 +294,16 @@ class MainWidget(Widget):
     self._out_of_hours_widget = OutOfHoursWidget(
         screen, bold_font, departure_updater.station()
     )
+    # Shown instead of the clock while departures are stale.
+    self._stale_widget = StaleWidget(screen, bold_font)
+    self._stale_since = 0
     self._departures_spacer = default_font.max_bounds()[1] + 2
     self._num_departures = -1
+    self._generation = -1
 
-    num_departures = (
-        screen.height - self._clock_widget.bounds()[1]
-    ) // self._departures_spacer
+    num_departures = num_departure_rows(
+        screen, bold_font, tall_font, default_font, render_seconds
+    )
     for i in range(num_departures):
       self._departure_widgets.append(
           DepartureWidget(
@@ -265,28 +314,71 @@ class MainWidget(Widget):
               fast_train_icon,
           )
       )
+    self._departure_bounds = [w.bounds() for w in self._departure_widgets]
 
   def render(self, now: tuple[int, ...]):
     """Render display. Currently assumes we're rendering entire display."""
     need_refresh = False
-    departures = self._departure_updater.departures()
-    if departures:
-      y = 0
-      for i, widget in enumerate(self._departure_widgets):
-        departure = departures[i] if i < len(departures) else None
-        need_refresh |= widget.render(departure, 0, y, *widget.bounds())
-        y += self._departures_spacer
-    else:
+    # Departures are only re-rendered when a new generation is published.
+    if self._departure_updater.departures().generation != self._generation:
+      need_refresh = self._render_departures()
+    if not self._num_departures:
       out_of_hours_bounds = self._out_of_hours_widget.bounds()
       x = (self._screen.width - out_of_hours_bounds[0]) // 2
       self._out_of_hours_widget.render(x, 0, *out_of_hours_bounds)
 
-    need_refresh |= self._num_departures != len(departures)
-    self._num_departures = len(departures)
-
     clock_bounds = self._clock_widget.bounds()
     x = (self._screen.width - clock_bounds[0]) // 2
     y = self._screen.height - clock_bounds[1]
 
-    need_refresh |= self._clock_widget.render(now, x, y, *clock_bounds)
+    stale_since = self._departure_updater.departures().stale_since
+    if stale_since != self._stale_since:
+      # Switching between the clock and when departures were last updated.
+      self._stale_since = stale_since
+      self._screen.fill_rect(0, y, self._screen.width, clock_bounds[1], 0)
+      self._clock_widget.reset()
+      need_refresh = True
+      if stale_since:
+        self._stale_widget.render(
+            stale_since, 0, y, self._screen.width, clock_bounds[1]
+        )
+    if not stale_since:
+      need_refresh |= self._clock_widget.render(now, x, y, *clock_bounds)
+    return need_refresh
+
+  def _render_departures(self) -> bool:
+    """Renders latest departures, retrying if the table was torn."""
+    while True:
+      departures = self._departure_updater.departures()
+      sequence = departures.sequence
+      need_refresh = self._render_rows(departures)
+      if departures.unchanged_since(sequence):
+        return need_refresh
+      # The network thread reused the table while it was being read, so the
+      # rows drawn may be inconsistent. Redraw all of them before they're
+      # flushed to the display.
+      self._generation = -1
+
+  def _render_rows(self, departures: trains.DepartureTable) -> bool:
+    """Renders rows that changed since the last generation rendered."""
+    changed_rows = departures.changed_rows
+    missed_generation = departures.generation != self._generation + 1
+    if missed_generation or not self._num_departures:
+      # Rows are only diffed against the previous generation, so if any were
+      # missed, or the out of hours message replaced them, redraw all of them.
+      changed_rows = -1
+    self._generation = departures.generation
+
+    num_departures = len(departures)
+    need_refresh = self._num_departures != num_departures
+    self._num_departures = num_departures
+    if num_departures:
+      y = 0
+      for i in range(len(self._departure_widgets)):
+        if changed_rows >> i & 1:
+          w, h = self._departure_bounds[i]
+          need_refresh |= self._departure_widgets[i].render(
+              departures, i, 0, y, w, h
+          )
+        y += self._departures_spacer
     return need_refresh
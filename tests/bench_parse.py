@@ -0,0 +1,134 @@
+# Copyright (c) 2023 Tom Ward
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Benchmarks parsing RTT search responses, json.loads() vs. in-place.
+
+Run from the repo root using the MicroPython unix port:
+
+  micropython tests/bench_parse.py
+
+For each response in tests/fixtures, this reports the average time to parse
+it and the peak heap used doing so. The heap is measured with the GC
+disabled, so it's everything allocated while parsing.
+"""
+
+import asyncio
+import gc
+import json
+import sys
+import time
+
+sys.path.append('src')
+
+import trains
+
+_FIXTURES = (
+    'search_btn_vic.json',
+    'search_hov_vic_late.json',
+    'search_empty.json',
+)
+_ITERATIONS = 20
+_STREAM_BUFFER_SIZE = 2048
+
+
+def _json_loads_departures(content) -> tuple[str, list]:
+  """Parses departures the way trains.py did before the in-place parser."""
+  response_json = json.loads(content)
+  services = response_json['services']
+  services = [] if services is None else services
+
+  departures = []
+  for service in services:
+    location = service['locationDetail']
+    destinations = service.get('destination', location['destination'])
+    destination = ','.join([d['description'] for d in destinations])
+    departure_time = int(location['gbttBookedDeparture'])
+    realtime_departure = int(location.get('realtimeDeparture', departure_time))
+    cancelled = location.get('cancelReasonCode') is not None
+    departures.append(
+        (destination, departure_time, realtime_departure, cancelled, False)
+    )
+  return response_json['location']['name'], departures
+
+
+class _Stream:
+  """Stream over `data`, like the body of an HTTP response."""
+
+  def __init__(self, data: bytes):
+    self._data = memoryview(data)
+    self._pos = 0
+
+  async def readinto(self, buf) -> int:
+    n = min(len(buf), len(self._data) - self._pos)
+    buf[:n] = self._data[self._pos : self._pos + n]
+    self._pos += n
+    return n
+
+
+async def _measure(parse) -> tuple[int, int]:
+  """Returns average microseconds and peak heap bytes to run `parse`."""
+  await parse()  # Warm up, e.g. interning destinations.
+  gc.collect()
+  gc.disable()
+  before = gc.mem_alloc()
+  await parse()
+  heap = gc.mem_alloc() - before
+  gc.enable()
+
+  gc.collect()
+  start = time.ticks_us()
+  for _ in range(_ITERATIONS):
+    await parse()
+  elapsed = time.ticks_diff(time.ticks_us(), start)
+  return elapsed // _ITERATIONS, heap
+
+
+async def _bench(name: str):
+  with open('tests/fixtures/' + name, 'rb') as f:
+    data = f.read()
+  content = memoryview(bytearray(data))
+  stream_buffer = memoryview(bytearray(_STREAM_BUFFER_SIZE))
+  table = trains.DepartureTable('')
+
+  async def json_loads():
+    _json_loads_departures(data)
+
+  async def in_place():
+    await trains._parse_departures(content, table)
+
+  async def streamed():
+    await trains._parse_departures(
+        stream_buffer, table, stream=_Stream(data)
+    )
+
+  print('{} ({} bytes)'.format(name, len(data)))
+  for parser, parse in (
+      ('json.loads', json_loads),
+      ('in-place', in_place),
+      ('streamed', streamed),
+  ):
+    us, heap = await _measure(parse)
+    print('  {:<12}{:>8} us{:>10} bytes'.format(parser, us, heap))
+
+
+async def main():
+  for name in _FIXTURES:
+    await _bench(name)
+
+
+asyncio.run(main())
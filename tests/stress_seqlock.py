@@ -0,0 +1,123 @@
+# Copyright (c) 2023 Tom Ward
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Stress tests handing departure tables between threads without locks.
+
+Run from the repo root using the MicroPython unix port:
+
+  micropython tests/stress_seqlock.py
+
+A writer thread keeps publishing one of two boards, while the main thread
+reads the latest table the way the render thread does, checking its sequence
+afterwards. Reads that see a mix of both boards must all be detected as torn.
+Exits with an error if any weren't.
+"""
+
+import sys
+import _thread
+
+sys.path.append('src')
+
+import trains
+
+# Station name, destination, hour departing, and number of departures.
+_BOARDS = (
+    ('Alpha', 'Alpha Sidings', 10, 8),
+    ('Bravo', 'Bravo Junction', 11, 5),
+)
+_PUBLISHES = 20000
+
+
+def _dump(name: str, destination: str, hour: int, count: int) -> bytes:
+  table = trains.DepartureTable(name)
+  index = table.destinations().intern(destination)
+  table.begin_merge()
+  for i in range(count):
+    departure_time = hour * 100 + i
+    table.merge(
+        hour << 8 | i, index, departure_time, departure_time, False, False
+    )
+  table.end_merge()
+  return table.dump(0)
+
+
+def _consistent(departures: trains.DepartureTable) -> bool:
+  """Returns whether `departures` is entirely one of the boards."""
+  for name, destination, hour, count in _BOARDS:
+    if departures.name == name:
+      break
+  else:
+    return False
+  if len(departures) != count:
+    return False
+  for i in range(count):
+    if (
+        departures.departure_time(i) // 100 != hour
+        or departures.destination(i) != destination
+    ):
+      return False
+  return True
+
+
+class _Stats:
+
+  def __init__(self):
+    self.done = False
+    self.reads = 0
+    self.torn = 0
+    self.undetected = 0
+
+
+def _write(updater: trains.DepartureUpdater, dumps, stats: _Stats):
+  try:
+    for i in range(_PUBLISHES):
+      updater.restore(dumps[i % len(dumps)])
+  finally:
+    stats.done = True
+
+
+def main():
+  dumps = [_dump(*board) for board in _BOARDS]
+  updater = trains.DepartureUpdater('Alpha', 'XXX', 'http://localhost', '', 0)
+  updater.restore(dumps[0])
+
+  stats = _Stats()
+  _thread.start_new_thread(_write, (updater, dumps, stats))
+  while not stats.done:
+    departures = updater.departures()
+    sequence = departures.sequence
+    try:
+      consistent = _consistent(departures)
+    except IndexError:
+      consistent = False
+    stats.reads += 1
+    if not departures.unchanged_since(sequence):
+      stats.torn += 1
+    elif not consistent:
+      stats.undetected += 1
+
+  print(
+      'reads: {} torn: {} undetected: {}'.format(
+          stats.reads, stats.torn, stats.undetected
+      )
+  )
+  if stats.undetected:
+    sys.exit(1)
+
+
+main()
@@ -0,0 +1,233 @@
+# Copyright (c) 2023 Tom Ward
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Tests parsing binary boards from the proxy.
+
+Run from the repo root using the MicroPython unix port:
+
+  micropython tests/test_board.py
+
+Boards are encoded here the same way as server._encode_board(), as the proxy
+can't be imported under MicroPython, then checked against parsing the same
+RTT response as JSON.
+"""
+
+import asyncio
+import json
+import struct
+import sys
+
+sys.path.append('src')
+
+import trains
+
+_FIXTURES = (
+    'search_btn_vic.json',
+    'search_hov_vic_late.json',
+    'search_empty.json',
+)
+# Buffer size when streaming, only just big enough for a single record.
+_STREAM_BUFFER_SIZE = 64
+
+
+def _encode_board(result, fast_services=()) -> bytes:
+  """Returns `result` as a binary board, see server._encode_board()."""
+  services = result['services'] or []
+  name = result['location']['name'].encode()
+  data = [struct.pack('<4sBB', b'PTB1', len(services), len(name)), name]
+  for service in services:
+    location = service['locationDetail']
+    departure_time = int(location['gbttBookedDeparture'])
+    realtime_departure = int(
+        location.get('realtimeDeparture') or departure_time
+    )
+    origins = location['origin']
+    yyyy, mm, dd = (int(part) for part in service['runDate'].split('-'))
+    flags = 0
+    if location.get('cancelReasonCode'):
+      flags |= 1
+    uid = service['serviceUid'].encode()
+    if uid in fast_services:
+      flags |= 2
+    destinations = service.get('destination') or location['destination']
+    destination = ','.join([d['description'] for d in destinations]).encode()
+    data.append(
+        struct.pack(
+            '<HHHHBBBBB',
+            departure_time,
+            realtime_departure,
+            int(origins[0]['publicTime']) if origins else 0xFFFF,
+            yyyy,
+            mm,
+            dd,
+            flags,
+            len(uid),
+            len(destination),
+        )
+    )
+    data.append(uid)
+    data.append(destination)
+  return b''.join(data)
+
+
+class _Stream:
+  """Stream over `data`, returning at most `chunk` bytes each read."""
+
+  def __init__(self, data: bytes, chunk: int = 7):
+    self._data = memoryview(data)
+    self._pos = 0
+    self._chunk = chunk
+
+  async def readinto(self, buf) -> int:
+    n = min(len(buf), len(self._data) - self._pos, self._chunk)
+    buf[:n] = self._data[self._pos : self._pos + n]
+    self._pos += n
+    return n
+
+
+def _load(name: str) -> bytes:
+  with open('tests/fixtures/' + name, 'rb') as f:
+    return f.read()
+
+
+def _assert_same(board: trains.DepartureTable, parsed: trains.DepartureTable):
+  assert board == parsed, (board, parsed)
+  assert len(board) == len(parsed)
+  for i in range(len(board)):
+    assert board.service(i) == parsed.service(i)
+    assert board.departure_epoch(i) == parsed.departure_epoch(i)
+    assert board.cancelled(i) == parsed.cancelled(i)
+
+
+async def test_board_matches_json():
+  for name in _FIXTURES:
+    data = _load(name)
+    parsed = await trains._parse_departures(
+        memoryview(bytearray(data)), trains.DepartureTable('')
+    )
+    board = await trains._parse_board(
+        memoryview(bytearray(_encode_board(json.loads(data)))),
+        trains.DepartureTable(''),
+    )
+    _assert_same(board, parsed)
+
+
+async def test_streamed_board_matches_json():
+  for name in _FIXTURES:
+    data = _load(name)
+    parsed = await trains._parse_departures(
+        memoryview(bytearray(data)), trains.DepartureTable('')
+    )
+    board = await trains._parse_board(
+        memoryview(bytearray(_STREAM_BUFFER_SIZE)),
+        trains.DepartureTable(''),
+        stream=_Stream(_encode_board(json.loads(data))),
+    )
+    _assert_same(board, parsed)
+
+
+async def test_board_fast_trains():
+  result = json.loads(_load('search_btn_vic.json'))
+  fast = result['services'][1]['serviceUid'].encode()
+  board = await trains._parse_board(
+      memoryview(bytearray(_encode_board(result, (fast,)))),
+      trains.DepartureTable(''),
+  )
+  assert not board.fast_train(0)
+  assert board.fast_train(1)
+
+
+async def test_board_cancelled():
+  result = json.loads(_load('search_btn_vic.json'))
+  service = result['services'][0]
+  service['locationDetail']['cancelReasonCode'] = 'M8'
+  service['destination'] = [{'description': 'Haywards Heath'}]
+  board = await trains._parse_board(
+      memoryview(bytearray(_encode_board(result))), trains.DepartureTable('')
+  )
+  assert board.cancelled(0)
+  assert board.destination(0) == 'Haywards Heath'
+  assert not board.cancelled(1)
+
+
+async def test_board_without_service():
+  result = json.loads(_load('search_btn_vic.json'))
+  result['services'] = result['services'][:3]
+  result['services'][0]['serviceUid'] = ''
+  result['services'][1]['serviceUid'] = ''
+  board = await trains._parse_board(
+      memoryview(bytearray(_encode_board(result))), trains.DepartureTable('')
+  )
+  assert len(board) == 3
+  assert board.service(0) == board.service(1) == 0
+  assert board.service(2)
+
+
+async def test_batch_of_boards():
+  data = [_load(name) for name in _FIXTURES]
+  batch = b''.join([_encode_board(json.loads(d)) for d in data])
+  tables = [trains.DepartureTable('') for _ in data]
+  await trains._parse_batch(
+      memoryview(bytearray(_STREAM_BUFFER_SIZE)),
+      tables,
+      stream=_Stream(batch),
+      binary=True,
+  )
+  for d, table in zip(data, tables):
+    parsed = await trains._parse_departures(
+        memoryview(bytearray(d)), trains.DepartureTable('')
+    )
+    _assert_same(table, parsed)
+
+
+async def test_truncated_board():
+  board = _encode_board(json.loads(_load('search_btn_vic.json')))
+  for length in (3, len(board) - 1):
+    try:
+      await trains._parse_board(
+          memoryview(bytearray(board[:length])), trains.DepartureTable('')
+      )
+    except ValueError:
+      pass
+    else:
+      raise AssertionError('Truncated board parsed')
+
+
+async def test_unrecognised_board():
+  try:
+    await trains._parse_board(
+        memoryview(bytearray(b'PTB0\x00\x00')), trains.DepartureTable('')
+    )
+  except ValueError:
+    pass
+  else:
+    raise AssertionError('Unrecognised board parsed')
+
+
+async def main():
+  tests = [
+      (name, test)
+      for name, test in sorted(globals().items())
+      if name.startswith('test_')
+  ]
+  for name, test in tests:
+    await test()
+    print(name, 'OK')
+
+
+asyncio.run(main())
@@ -0,0 +1,237 @@
+# Copyright (c) 2023 Tom Ward
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Tests merging responses into departure tables.
+
+Run from the repo root using the MicroPython unix port:
+
+  micropython tests/test_merge.py
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+sys.path.append('src')
+
+import trains
+import utils
+
+
+def _now_minutes() -> int:
+  now = utils.get_uk_time()
+  return now[3] * 60 + now[4]
+
+
+def _hh_mm(minutes: int) -> int:
+  """Returns [h]h[m]m time `minutes` past midnight."""
+  hh, mm = divmod(minutes % (24 * 60), 60)
+  return hh * 100 + mm
+
+
+def _merge(table: trains.DepartureTable, departures, complete: bool = True):
+  """Merges (service, destination, time) departures into `table`."""
+  table.begin_merge()
+  for service, destination, departure_time in departures:
+    index = table.destinations().intern(destination)
+    table.merge(service, index, departure_time, departure_time, False, False)
+  if complete:
+    table.end_merge()
+
+
+def _services(table: trains.DepartureTable) -> list[int]:
+  return [table.service(i) for i in range(len(table))]
+
+
+def test_merge_adds_in_order():
+  table = trains.DepartureTable('Brighton')
+  _merge(table, ((1, 'London Victoria', 1000), (2, 'Bedford', 1010)))
+  assert _services(table) == [1, 2]
+  assert table.changes == 2
+  assert table.destination(0) == 'London Victoria'
+  assert table.destination(1) == 'Bedford'
+  assert table.departure_time(1) == 1010
+
+
+def test_merge_unchanged_has_no_changes():
+  table = trains.DepartureTable('Brighton')
+  departures = ((1, 'London Victoria', 1000), (2, 'Bedford', 1010))
+  _merge(table, departures)
+  _merge(table, departures)
+  assert _services(table) == [1, 2]
+  assert table.changes == 0
+
+
+def test_merge_updates_in_place():
+  table = trains.DepartureTable('Brighton')
+  _merge(table, ((1, 'London Victoria', 1000), (2, 'Bedford', 1010)))
+  destinations = table.destinations()
+  table.begin_merge()
+  table.merge(
+      1, destinations.intern('London Victoria'), 1000, 1000, False, False
+  )
+  table.merge(2, destinations.intern('Bedford'), 1010, 1014, False, False)
+  table.end_merge()
+  assert _services(table) == [1, 2]
+  assert table.changes == 1
+  assert table.actual_departure_time(1) == 1014
+
+
+def test_merge_moves_and_removes():
+  table = trains.DepartureTable('Brighton')
+  _merge(
+      table,
+      (
+          (1, 'London Victoria', 1000),
+          (2, 'Bedford', 1010),
+          (3, 'Cambridge', 1020),
+      ),
+  )
+  _merge(table, ((3, 'Cambridge', 1020), (4, 'Bedford', 1030)))
+  assert _services(table) == [3, 4]
+  assert table.destination(0) == 'Cambridge'
+
+
+def test_merge_without_service_always_adds():
+  table = trains.DepartureTable('Brighton')
+  _merge(table, ((0, 'London Victoria', 1000), (0, 'London Victoria', 1000)))
+  assert len(table) == 2
+
+
+def test_parse_without_service_always_adds():
+  with open('tests/fixtures/search_btn_vic.json') as f:
+    result = json.load(f)
+  result['services'] = result['services'][:3]
+  del result['services'][0]['serviceUid']
+  result['services'][1]['serviceUid'] = ''
+  content = json.dumps(result).encode()
+
+  table = trains.DepartureTable('')
+  for _ in range(2):
+    asyncio.run(
+        trains._parse_departures(memoryview(bytearray(content)), table)
+    )
+    assert len(table) == 3
+    assert _services(table)[:2] == [0, 0]
+    assert table.departure_time(0) != table.departure_time(1)
+
+
+def test_merge_when_full():
+  table = trains.DepartureTable('Brighton')
+  table.begin_merge()
+  index = table.destinations().intern('London Victoria')
+  for i in range(trains._MAX_DEPARTURES):
+    assert table.merge(i + 1, index, 1000 + i, 1000 + i, False, False)
+  assert not table.can_merge()
+  assert not table.merge(100, index, 1100, 1100, False, False)
+  table.end_merge()
+  assert table.is_full()
+  assert table.service(trains._MAX_DEPARTURES - 1) == trains._MAX_DEPARTURES
+
+
+def test_abort_merge_restores_order():
+  table = trains.DepartureTable('Brighton')
+  _merge(
+      table,
+      (
+          (1, 'London Victoria', 2350),
+          (2, 'Bedford', 5),
+          (3, 'Cambridge', 15),
+      ),
+  )
+  # A partial response moves the later departure ahead of the others, and
+  # leaves those it didn't get to out of order.
+  _merge(table, ((3, 'Cambridge', 15),), complete=False)
+  assert _services(table) == [3, 2, 1]
+  table.abort_merge(23 * 60 + 45)
+  assert _services(table) == [1, 2, 3]
+  # Aborting leaves everything in the table.
+  table.end_merge()
+  assert len(table) == 3
+
+
+def test_merge_departures_interleaves_routes():
+  now_minutes = _now_minutes()
+  destinations = trains._Destinations(trains._MAX_DESTINATIONS * 2)
+  first = trains.DepartureTable('Brighton', destinations)
+  _merge(
+      first,
+      (
+          (1, 'London Victoria', _hh_mm(now_minutes + 5)),
+          (2, 'London Victoria', _hh_mm(now_minutes + 20)),
+      ),
+  )
+  second = trains.DepartureTable('Hove', destinations)
+  _merge(
+      second,
+      (
+          (3, 'Bedford', _hh_mm(now_minutes + 10)),
+          # Also runs on the first route.
+          (2, 'London Victoria', _hh_mm(now_minutes + 20)),
+          (4, 'Bedford', _hh_mm(now_minutes + 30)),
+      ),
+  )
+
+  table = trains.DepartureTable('', destinations)
+  trains._merge_departures((first, second), table, bytearray(2))
+  assert table.name == 'Brighton'
+  assert _services(table) == [1, 3, 2, 4]
+  assert table.destination(1) == 'Bedford'
+
+
+def test_merge_departures_drops_departed():
+  now = time.mktime(utils.get_uk_time())
+  now_minutes = _now_minutes()
+  route = trains.DepartureTable('Brighton')
+  index = route.destinations().intern('London Victoria')
+  route.begin_merge()
+  for service, minutes in ((1, -2), (2, 3), (3, 10)):
+    departure_time = _hh_mm(now_minutes + minutes)
+    route.merge(
+        service,
+        index,
+        departure_time,
+        departure_time,
+        False,
+        False,
+        now + minutes * 60,
+    )
+  route.end_merge()
+
+  table = trains.DepartureTable('')
+  trains._merge_departures((route,), table, bytearray(1))
+  assert _services(table) == [2, 3]
+  # Also drops those leaving too soon to catch.
+  table.clear()
+  trains._merge_departures((route,), table, bytearray(1), 5)
+  assert _services(table) == [3]
+
+
+def main():
+  tests = [
+      (name, test)
+      for name, test in sorted(globals().items())
+      if name.startswith('test_')
+  ]
+  for name, test in tests:
+    test()
+    print(name, 'OK')
+
+
+main()
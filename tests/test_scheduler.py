@@ -0,0 +1,169 @@
+# Copyright (c) 2024 Tom Ward
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""Tests scheduling departure updates.
+
+Run from the repo root using the MicroPython unix port:
+
+  micropython tests/test_scheduler.py
+"""
+
+import sys
+
+sys.path.append('src')
+
+import scheduler
+import trains
+import utils
+
+_MIN_INTERVAL = 30
+_MAX_INTERVAL = 600
+
+
+def _departures(*minutes_ahead: int) -> trains.DepartureTable:
+  """Returns table with departures `minutes_ahead` of now."""
+  now = utils.get_uk_time()
+  table = trains.DepartureTable('Brighton')
+  index = table.destinations().intern('London Victoria')
+  table.begin_merge()
+  for i, minutes in enumerate(minutes_ahead):
+    hh, mm = divmod((now[3] * 60 + now[4] + minutes) % (24 * 60), 60)
+    departure_time = hh * 100 + mm
+    table.merge(i + 1, index, departure_time, departure_time, False, False)
+  table.end_merge()
+  return table
+
+
+def _scheduler(interval: int = _MIN_INTERVAL) -> scheduler.UpdateScheduler:
+  return scheduler.UpdateScheduler(interval, _MIN_INTERVAL, _MAX_INTERVAL)
+
+
+def test_backs_off_while_unchanged():
+  updates = _scheduler()
+  departures = _departures(3 * 60)
+  intervals = [updates.schedule(departures, False) for _ in range(7)]
+  assert intervals == [30, 60, 120, 240, 480, 600, 600], intervals
+
+
+def test_resets_when_changed():
+  updates = _scheduler()
+  departures = _departures(3 * 60)
+  for _ in range(4):
+    updates.schedule(departures, False)
+  assert updates.schedule(departures, True) == _MIN_INTERVAL
+  assert updates.schedule(departures, False) == _MIN_INTERVAL
+
+
+def test_no_departures():
+  updates = _scheduler()
+  assert updates.schedule(_departures(), True) == _MAX_INTERVAL
+
+
+def test_cancelled_departures_ignored():
+  departures = _departures(2, 3 * 60)
+  # Cancel the imminent departure, leaving the rest in place.
+  departures.begin_merge()
+  departures.merge(
+      departures.service(0),
+      0,
+      departures.departure_time(0),
+      departures.departure_time(0),
+      True,
+      False,
+  )
+  updates = _scheduler(_MAX_INTERVAL)
+  assert updates.schedule(departures, False) == _MAX_INTERVAL
+
+
+def test_imminent_departure():
+  updates = scheduler.UpdateScheduler(60, _MIN_INTERVAL, _MAX_INTERVAL)
+  departures = _departures(2)
+  # Stops backing off, without polling any faster than the interval.
+  assert [updates.schedule(departures, False) for _ in range(3)] == [60] * 3
+  assert updates.schedule(departures, True) == _MIN_INTERVAL
+
+
+def test_fraction_of_time_until_departure():
+  updates = scheduler.UpdateScheduler(1000, _MIN_INTERVAL, 3600)
+  interval = updates.schedule(_departures(60), False)
+  # A quarter of the 59 to 60 minutes until it leaves.
+  assert 59 * 60 // 4 <= interval <= 60 * 60 // 4, interval
+
+
+def test_deadlines():
+  updates = _scheduler()
+  interval = updates.schedule(_departures(3 * 60), True)
+  delay_ms = updates.delay_ms()
+  assert interval * 1000 - 1000 < delay_ms <= interval * 1000, delay_ms
+  updates.retry(5)
+  assert 4000 < updates.delay_ms() <= 5000
+  updates.retry(0)
+  assert updates.delay_ms() == 0
+
+
+def test_seconds_until():
+  now = (2024, 1, 1, 23, 50, 30)
+  assert scheduler._seconds_until(2355, now) == 4 * 60 + 30
+  # Wraps past midnight.
+  assert scheduler._seconds_until(5, now) == 14 * 60 + 30
+  # Already departed.
+  assert scheduler._seconds_until(2340, now) == 0
+
+
+def test_circuit_breaker():
+  breaker = scheduler.CircuitBreaker(3, 10, 60, 300)
+  assert 1 <= breaker.failed() <= 10
+  assert 1 <= breaker.failed() <= 20
+  assert not breaker.is_open
+  # Opens after 3 failures, then only probes.
+  for _ in range(5):
+    assert 300 <= breaker.failed() <= 375
+  assert breaker.is_open
+  assert breaker.succeeded()
+  assert not breaker.is_open
+  assert not breaker.succeeded()
+  assert 1 <= breaker.failed() <= 10
+
+
+def test_circuit_breaker_jitter():
+  delays = set()
+  for _ in range(50):
+    breaker = scheduler.CircuitBreaker(3, 10, 60, 300)
+    delays.add(breaker.failed())
+  # Spread over the whole delay, rather than all retrying together.
+  assert min(delays) < 5 and max(delays) > 5, delays
+
+
+def test_circuit_breaker_caps_delay():
+  breaker = scheduler.CircuitBreaker(100, 10, 60, 300)
+  for _ in range(20):
+    assert 1 <= breaker.failed() <= 60
+
+
+def main():
+  tests = [
+      (name, test)
+      for name, test in sorted(globals().items())
+      if name.startswith('test_')
+  ]
+  for name, test in tests:
+    test()
+    print(name, 'OK')
+
+
+main()